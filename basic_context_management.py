@@ -1,92 +1,82 @@
 #!/usr/bin/env python3
-import subprocess
-import sys
+import json
 
-def install(package):
-    subprocess.check_call([sys.executable, "-m", "pip", "install", package])
+import openai
+from termcolor import colored
 
-try:
-    import openai
-except ImportError:
-    print("Installing module: openai")
-    install('openai')
-    import openai
+import instrumentation
+from chat_context import TRUNCATION_NOTICES, ChatContext
+from completion_cache import CompletionCache
+from conversation import MODEL
+from message_archive import MessageArchive
+from session_log import SessionLog
+from summarizer import SummaryCache
 
-try:
-    import tiktoken
-except ImportError:
-    print("Installing module: tiktoken")
-    install('tiktoken')
-    import tiktoken
-
-try:
-    from termcolor import colored
-except ImportError:
-    print("Installing module: termcolor")
-    install('termcolor')
-    from termcolor import colored
+instrumentation.configure_from_environment()  # LLM_METRICS / LLM_PROFILE, see instrumentation.py
 
 print("")
 openai.api_key = input("Please enter your OpenAI API key: ")
 MAX_TOKENS = 512
+RESPONSE_TOKENS = 128  # Reserved out of MAX_TOKENS for the reply
+RECALL_TOKENS = 64  # Reserved out of MAX_TOKENS for earlier messages recalled from the archive
+ARCHIVE_PATH = "message_archive.db"  # Where removed messages are kept to be recalled
+COMPLETION_CACHE_DIR = ".completion_cache"  # Where responses are kept to answer repeated requests
+SESSION_LOG_PATH = "sessions.db"  # Where conversations are kept to be resumed
 
-def num_tokens_from_messages(messages):
-    """Returns the number of tokens used by a list of messages."""
-    model = "gpt-3.5-turbo"
-    encoding = tiktoken.encoding_for_model(model)
-    num_tokens = 0
-    for message in messages:
-        num_tokens += len(encoding.encode(message["content"]))
-    return num_tokens
-
+@instrumentation.timed("completion")
 def openai_chat_completion(messages):
-    """Returns the response from the OpenAI API given an array of messages."""
+    """Returns the response from the OpenAI API given an array of messages, or the cached one to the same request."""
+    return completion_cache.complete(request_chat_completion, messages, model=MODEL, max_tokens=RESPONSE_TOKENS)
+
+def request_chat_completion(messages):
     response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
+        model=MODEL,
         messages=messages,
+        max_tokens=RESPONSE_TOKENS,
     )
     return response.choices[0].message['content']
 
-def truncate_by_removing(conversation_history):
-    """Removes the oldest messages until the conversation history is short enough."""
-    print(colored("Removing oldest messages.", 'red'))
-    while num_tokens_from_messages(conversation_history) > MAX_TOKENS:
-        conversation_history.pop(0)
-    return conversation_history
+def print_truncation(truncation):
+    print(colored(TRUNCATION_NOTICES[truncation], 'red'))
 
-def truncate_by_summarizing(conversation_history):
-    """Summarizes the oldest messages until the conversation history is short enough."""
-    print(colored("Removing oldest messages.", 'red'))
-    messages_to_remove = []
-    while num_tokens_from_messages(conversation_history) > MAX_TOKENS:
-        messages_to_remove.append(conversation_history.pop(0))
-    if messages_to_remove:
-        messages_to_remove.append({"role": "system", "content": "You are responsible for summarizing the previous conversation."})
-        summary = openai_chat_completion(messages_to_remove)
-        print(colored(f"\nSummary of removed messages: \n{summary}", 'yellow'))
-        conversation_history.insert(0, {"role": "assistant", "content": f'Summary of Removed Messages: {summary}'})
-    return conversation_history
+def print_summary(summary):
+    print(colored(f"\nSummary of removed messages: \n{summary}", 'yellow'))
 
-conversation_history = []
+session_log = SessionLog(SESSION_LOG_PATH, input("Session to resume (press Enter to start a new one): ") or None)
+completion_cache = CompletionCache(directory=COMPLETION_CACHE_DIR)
+# No policy until the user picks one; summaries are only made in the background once they have picked summarize.
+context = ChatContext(SummaryCache(openai_chat_completion), MessageArchive(ARCHIVE_PATH, session_log.session_id),
+                      session_log.load(), truncation=None, max_tokens=MAX_TOKENS, response_tokens=RESPONSE_TOKENS,
+                      recall_tokens=RECALL_TOKENS, on_truncate=print_truncation, on_summary=print_summary)
+conversation_history = context.history
+print(colored(f"Session {session_log.session_id}: {len(conversation_history)} messages resumed", 'cyan'))
 while True:
-    if num_tokens_from_messages(conversation_history) > MAX_TOKENS:
-        trunc_method = input(colored("\nConversation history is too long. Would you like to remove the oldest messages until it fits or summarize the conversation? ", 'red'))
+    if not context.fits():
+        trunc_method = input(colored("\nConversation history is too long. Would you like to remove the oldest messages until it fits, summarize the conversation, or keep the most relevant messages? ", 'red'))
         if trunc_method.lower() in ['summarize', 's']:
-            conversation_history = truncate_by_summarizing(conversation_history)
+            context.truncation = "summarize"
+            context.truncate()
         elif trunc_method.lower() in ['remove', 'r']:
-            conversation_history = truncate_by_removing(conversation_history)
+            context.truncation = "remove"
+            context.truncate()
+        elif trunc_method.lower() in ['keep', 'relevant', 'k']:
+            context.truncation = "relevance"
+            context.truncate()
     
     user_input = input("\nPlease enter your request (type 'q' or 'quit' to exit): ")
     if user_input.lower() in ['q', 'quit']:
+        print(colored(f"\nCompletion cache: {json.dumps(completion_cache.stats())}", 'cyan'))
         break
 
-    new_message = {"role": "user", "content": user_input}
-    conversation_history.append(new_message)
+    context.add_user_message(user_input)
 
-    print(colored(f"\n{num_tokens_from_messages(conversation_history)} tokens", 'green'))
-    print(colored("\nFull conversation history:", 'blue'))
-    for message in conversation_history:
-        print(message)
-    response_content = openai_chat_completion(conversation_history)
-    conversation_history.append({"role": "assistant", "content": response_content})
+    with instrumentation.timer("console_output"):
+        print(colored(f"\n{conversation_history.total_tokens} tokens", 'green'))
+        print(colored("\nFull conversation history:", 'blue'))
+        for message in conversation_history:
+            print(message)
+    session_log.sync(conversation_history)  # Keep the request if the process dies waiting for the reply
+    response_content = openai_chat_completion(context.request())  # With relevant removed messages, if any
+    context.add_reply(response_content)  # And compact the oldest messages while the user is typing
+    session_log.sync(conversation_history)
     print(f"\nResponse: \n{response_content}")
\ No newline at end of file
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""Replays scripted conversations against a mock or real ChatCompletion endpoint.
+
+Each turn goes through the same code the chat examples run: ChatContext
+for truncation (any of its policies), background summaries, the message
+archive and recall, then the CompletionCache and the StreamingClient for
+the reply. The report is one JSON object:
+
+    python benchmark_chat.py --conversations 50 --turns 20 --concurrency 10 --policy summarize
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import socket
+import time
+
+import aiohttp
+import openai
+
+from chat_context import TRUNCATIONS, ChatContext
+from completion_cache import CompletionCache
+from conversation import MODEL, StreamingTokenCounter, TokenLedger
+from message_archive import MessageArchive
+from mock_server import MockChatCompletionServer
+from streaming import StreamMetrics, StreamingClient, percentile
+from summarizer import SummaryCache
+
+WORDS = ["shadow", "cave", "fire", "light", "prisoner", "chain", "sun", "truth", "image", "reason",
+         "wall", "puppet", "voice", "sound", "reality", "vision", "ascent", "soul", "knowledge", "form"]
+
+def scripted_conversations(num_conversations, turns, words_per_message, seed=0):
+    """Returns reproducible synthetic conversations, each a list of user messages."""
+    rng = random.Random(seed)
+    return [
+        [" ".join(rng.choice(WORDS) for _ in range(words_per_message)) for _ in range(turns)]
+        for _ in range(num_conversations)
+    ]
+
+def load_conversations(path):
+    """Loads conversations from a JSON file holding a list of lists of user messages."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def serve_mock(port, options):
+    MockChatCompletionServer(port=port, **options).serve_forever()
+
+def start_mock_server(options):
+    """Starts the mock server in its own process, so its CPU time is not counted as client time."""
+    port = free_port()
+    process = multiprocessing.Process(target=serve_mock, args=(port, options), daemon=True)
+    process.start()
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                process.terminate()
+                raise
+            time.sleep(0.05)
+    return process, f"http://127.0.0.1:{port}/v1"
+
+def summary_completion(messages, max_tokens):
+    """Returns a non-streamed completion, used for summaries as in the chat examples."""
+    response = openai.ChatCompletion.create(model=MODEL, messages=messages, max_tokens=max_tokens)
+    return response.choices[0].message['content']
+
+async def run_conversation(script, args, client, summary_cache, completion_cache, semaphore, turns):
+    async with semaphore:
+        summaries = []
+        # An archive of its own in memory, so conversations only recall their own messages
+        history = TokenLedger() if args.policy == "trim" else None  # Only a TokenLedger can cut partway into a message
+        context = ChatContext(summary_cache, MessageArchive(), history, args.policy, max_tokens=args.max_tokens,
+                              response_tokens=args.response_tokens, recall_tokens=args.recall_tokens,
+                              on_summary=summaries.append)
+        for user_input in script:
+            turn = {}
+            summaries.clear()
+            try:
+                context_start = time.perf_counter()
+                # Truncation may summarize, which blocks; the scripts run it the same way.
+                request = await asyncio.to_thread(context.prepare, user_input)
+                turn["context_time"] = time.perf_counter() - context_start
+
+                token_counter = StreamingTokenCounter()
+                metrics = StreamMetrics()
+                parts = []
+                chunks = completion_cache.stream(client.stream, request, model=client.model, **client.params)
+                async for chunk_content in chunks:
+                    metrics.record_chunk()
+                    token_counter.add(chunk_content)
+                    parts.append(chunk_content)
+            except Exception as e:
+                context.discard_user_message()  # So the next turn does not send two user messages in a row
+                turn["error"] = type(e).__name__
+            else:
+                context.add_reply("".join(parts), token_counter.message_tokens())
+                turn.update(metrics.finish(token_counter.total))
+            turn["summarized"] = bool(summaries)
+            turns.append(turn)
+        context.summarizer.cancel()
+        context.archive.close()
+
+async def run_benchmark(conversations, args):
+    """Runs every conversation and returns the per-turn records, the summary cache and the completion cache."""
+    client = StreamingClient(max_retries=args.max_retries, max_tokens=args.response_tokens)
+    summary_cache = SummaryCache(lambda messages: summary_completion(messages, args.response_tokens))
+    completion_cache = CompletionCache(ttl=args.completion_cache_ttl)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    turns = []
+    async with aiohttp.ClientSession() as session:
+        openai.aiosession.set(session)
+        await asyncio.gather(*(run_conversation(script, args, client, summary_cache, completion_cache, semaphore, turns)
+                               for script in conversations))
+    return turns, summary_cache, completion_cache
+
+def report(args, turns, summary_cache, completion_cache, wall_time, cpu_time):
+    """Returns the benchmark report."""
+    completed = [turn for turn in turns if "error" not in turn]
+
+    def stat(key, fraction):
+        values = sorted(turn[key] for turn in completed if turn.get(key) is not None)
+        return percentile(values, fraction)
+
+    return {
+        "conversations": args.conversations,
+        "turns": len(turns),
+        "errors": len(turns) - len(completed),
+        "concurrency": args.concurrency,
+        "policy": args.policy,
+        "wall_time": wall_time,
+        "turns_per_second": len(completed) / wall_time if wall_time else None,
+        "time_to_first_token_p50": stat("time_to_first_token", 0.5),
+        "time_to_first_token_p90": stat("time_to_first_token", 0.9),
+        "time_to_first_token_p99": stat("time_to_first_token", 0.99),
+        "tokens_per_second_p50": stat("tokens_per_second", 0.5),
+        "context_time_p50": stat("context_time", 0.5),
+        "context_time_p99": stat("context_time", 0.99),
+        "client_cpu_ms_per_turn": 1000 * cpu_time / len(turns) if turns else None,
+        "summaries": sum(turn["summarized"] for turn in turns),
+        "summary_cache_hits": summary_cache.hits,
+        "summary_cache_misses": summary_cache.misses,
+        "completion_cache": completion_cache.stats(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chat examples against a mock or real endpoint.")
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--words-per-message", type=int, default=40)
+    parser.add_argument("--script", help="JSON file with a list of conversations, each a list of user messages")
+    parser.add_argument("--concurrency", type=int, default=10, help="Conversations in flight at once")
+    parser.add_argument("--policy", choices=TRUNCATIONS, default="remove")
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--response-tokens", type=int, default=128)
+    parser.add_argument("--recall-tokens", type=int, default=64, help="Reserved for messages recalled from the archive")
+    parser.add_argument("--completion-cache-ttl", type=float, default=24 * 3600,
+                        help="Seconds cached responses are reused for, 0 to send every request")
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--api-base", help="Use this endpoint instead of starting the mock server")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock server: seconds before the first byte")
+    parser.add_argument("--chunk-size", type=int, default=1, help="Mock server: words per chunk")
+    parser.add_argument("--token-rate", type=float, default=0, help="Mock server: words per second, 0 for unlimited")
+    parser.add_argument("--reply-words", type=int, default=60, help="Mock server: words per reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Mock server: fraction of requests that fail")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="Mock server: fraction of streams cut off")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.script:
+        conversations = load_conversations(args.script)
+        args.conversations = len(conversations)
+    else:
+        conversations = scripted_conversations(args.conversations, args.turns, args.words_per_message, args.seed)
+
+    server = None
+    if args.api_base:
+        openai.api_base = args.api_base
+    else:
+        options = {"latency": args.latency, "chunk_size": args.chunk_size, "token_rate": args.token_rate,
+                   "reply_words": args.reply_words, "error_rate": args.error_rate,
+                   "disconnect_rate": args.disconnect_rate, "seed": args.seed}
+        server, openai.api_base = start_mock_server(options)
+        openai.api_key = "mock"
+
+    try:
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        turns, summary_cache, completion_cache = asyncio.run(run_benchmark(conversations, args))
+        wall_time = time.perf_counter() - wall_start
+        cpu_time = time.process_time() - cpu_start
+    finally:
+        if server is not None:
+            server.terminate()
+    print(json.dumps(report(args, turns, summary_cache, completion_cache, wall_time, cpu_time), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""Benchmarks keyword extraction and consolidation on the built-in text and on synthetic corpora.
+
+Two suites run, each scenario in a fresh process so its peak memory is its own:
+
+- length scaling: the built-in text, then synthetic texts 10x and 100x as long
+  made from its sentences, extracted window by window like --input;
+- corpus scaling: 1 to 10,000 synthetic documents, extracted in batches like --corpus.
+
+Each reports per-extractor latency, peak RSS, and consensus and dedupe time.
+Nothing is downloaded, so the models and NLTK data must already be installed.
+The report is one JSON object; with a baseline report it also lists every
+metric that regressed by more than the tolerance, and exits with status 1:
+
+    python benchmark_keywords.py --save-baseline keyword_baseline.json
+    python benchmark_keywords.py --baseline keyword_baseline.json --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from core import NLTK_RESOURCE_PATHS, require
+from keyword_generation import (DEDUPE_THRESHOLD, EXTRACTORS, MIN_SUPPORT, MODEL_TIER, MODEL_TIERS, RAKE_NLTK_DATA,
+                                SENTENCE_END, KeywordMerger, consensus_support, extract_corpus_keywords,
+                                fuzzy_deduplicate, iter_windows, keyword_phrases, keyword_scores, package_version,
+                                peak_rss_mb, run_extractors, set_model_tier, text, warm_worker)
+
+PACKAGES = ("spacy", "pytextrank", "yake", "rake-nltk", "nltk", "fuzzywuzzy", "rapidfuzz", "numpy")
+MIN_COMPARED_SECONDS = 0.01  # Timings shorter than this in the baseline are too noisy to flag
+
+def fixture_sentences():
+    """Returns the sentences of the built-in text, which the synthetic corpora are made of."""
+    return [sentence for sentence in SENTENCE_END.split(" ".join(text.split())) if sentence]
+
+def scaled_text(scale, seed=0):
+    """Returns the built-in text for scale 1, else a reproducible text about `scale` times as long.
+
+    The longer texts are paragraphs of 5 to 15 of the built-in text's sentences, shuffled.
+    """
+    if scale == 1:
+        return text
+    rng = random.Random(seed)
+    sentences = fixture_sentences()
+    target = scale * len(text)
+    paragraphs, size = [], 0
+    while size < target:
+        paragraph = " ".join(rng.choice(sentences) for _ in range(rng.randint(5, 15)))
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+def synthetic_documents(count, seed=0):
+    """Yields `count` reproducible (id, text) documents of 5 to 40 of the built-in text's sentences."""
+    rng = random.Random(seed)
+    sentences = fixture_sentences()
+    for doc_id in range(count):
+        yield doc_id, " ".join(rng.choice(sentences) for _ in range(rng.randint(5, 40)))
+
+def check_offline(model_tier):
+    """Raises if the benchmark would need to download a model or NLTK data."""
+    nltk = require("nltk")
+    for resource in RAKE_NLTK_DATA:
+        try:
+            nltk.data.find(NLTK_RESOURCE_PATHS[resource])
+        except LookupError as e:
+            raise LookupError(f"NLTK {resource} data is not installed and the benchmark does not download it. "
+                              f"Install it with: python -m nltk.downloader {resource}") from e
+    model = MODEL_TIERS[model_tier]
+    if model is not None and not require("spacy").util.is_package(model):
+        raise OSError(f"spaCy model {model} is not installed. Install it with: python -m spacy download {model}")
+
+def measure_consolidation(results):
+    """Returns the consolidated keywords for results, timing the consensus and dedupe steps separately."""
+    start = time.perf_counter()
+    all_keywords = keyword_phrases(results)
+    scores = keyword_scores(results)
+    scoring_time = time.perf_counter() - start
+    start = time.perf_counter()
+    supported = [
+        keyword
+        for keywords, supports in zip(all_keywords, consensus_support(all_keywords))
+        for keyword, support in zip(keywords, supports)
+        if support >= MIN_SUPPORT
+    ]
+    consensus_time = time.perf_counter() - start
+    start = time.perf_counter()
+    keywords = fuzzy_deduplicate(supported, match_threshold=DEDUPE_THRESHOLD, scores=scores)
+    dedupe_time = time.perf_counter() - start
+    return keywords, {
+        "consensus_time": consensus_time,
+        "dedupe_time": dedupe_time,
+        "consolidation_time": scoring_time + consensus_time + dedupe_time,
+    }
+
+def warm(model_tier):
+    """Loads every extractor in this process and returns how long it took."""
+    start = time.perf_counter()
+    set_model_tier(model_tier)
+    warm_worker(EXTRACTORS)
+    return time.perf_counter() - start
+
+def measure_length(scale, model_tier, seed=0):
+    """Extracts and consolidates keywords for a text `scale` times as long as the built-in one, in this process."""
+    load_time = warm(model_tier)
+    source = scaled_text(scale, seed)
+    timings = defaultdict(float)
+    merger = KeywordMerger(EXTRACTORS)
+    windows = 0
+    start = time.perf_counter()
+    for window in iter_windows(source):
+        results, window_timings = run_extractors(EXTRACTORS, window)
+        for name, seconds in window_timings.items():
+            timings[name] += seconds
+        merger.add(results, len(window))
+        windows += 1
+    if windows > 1:
+        results = merger.results()
+    extract_time = time.perf_counter() - start
+    keywords, consolidation = measure_consolidation(results)
+    return {
+        "scale": scale,
+        "chars": len(source),
+        "windows": windows,
+        "keywords": len(keywords),
+        "load_time": load_time,
+        "extract_time": extract_time,
+        "timings": dict(timings),
+        **consolidation,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def measure_corpus(count, model_tier, batch_size=32, n_process=1, seed=0):
+    """Extracts and consolidates keywords for `count` synthetic documents, in this process."""
+    load_time = warm(model_tier)
+    totals = defaultdict(float)
+    timings = {}
+    start = time.perf_counter()
+    for _, results in extract_corpus_keywords(synthetic_documents(count, seed), batch_size, n_process, timings):
+        _, consolidation = measure_consolidation(results)
+        for name, seconds in consolidation.items():
+            totals[name] += seconds
+    wall_time = time.perf_counter() - start
+    return {
+        "documents": count,
+        "chars": sum(len(document) for _, document in synthetic_documents(count, seed)),
+        "load_time": load_time,
+        "wall_time": wall_time,
+        "extract_time": wall_time - totals["consolidation_time"],
+        "timings": timings,
+        **totals,
+        "documents_per_second": count / wall_time if wall_time else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def run_isolated(function, *args):
+    """Runs function(*args) in a fresh process and returns its result."""
+    with ProcessPoolExecutor(1) as executor:
+        return executor.submit(function, *args).result()
+
+def environment(model_tier):
+    """Returns what the numbers depend on: the machine, the model and the package versions."""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "model_tier": model_tier,
+        "model": MODEL_TIERS[model_tier] or "blank:en",
+        "packages": {name: package_version(name) for name in PACKAGES},
+    }
+
+def flatten_metrics(report):
+    """Returns the report's timing, memory and throughput metrics as {name: value}."""
+    metrics = {}
+    for suite, key in (("length_scaling", "scale"), ("corpus_scaling", "documents")):
+        for entry in report.get(suite, []):
+            prefix = f"{suite}.{key}={entry[key]}"
+            for name, value in entry.items():
+                if name == "timings":
+                    for extractor, seconds in value.items():
+                        metrics[f"{prefix}.timings.{extractor}"] = seconds
+                elif name.endswith(("_time", "_mb", "_per_second")) and value is not None:
+                    metrics[f"{prefix}.{name}"] = value
+    return metrics
+
+def compare(report, baseline, tolerance=0.2):
+    """Returns the change of every metric found in both reports, flagging those worse by more than tolerance."""
+    current = flatten_metrics(report)
+    comparison = []
+    for name, before in flatten_metrics(baseline).items():
+        after = current.get(name)
+        if after is None or not before:
+            continue
+        change = after / before - 1
+        if name.endswith("_per_second"):
+            regression = change < -tolerance
+        else:
+            regression = change > tolerance and (name.endswith("_mb") or before >= MIN_COMPARED_SECONDS)
+        comparison.append({"metric": name, "baseline": before, "current": after, "change": change, "regression": regression})
+    return comparison
+
+def parse_counts(value):
+    return [int(count) for count in value.split(",") if count]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark keyword extraction and consolidation offline.")
+    parser.add_argument("--lengths", type=parse_counts, default=[1, 10, 100], help="Comma-separated multiples of the built-in text's length")
+    parser.add_argument("--documents", type=parse_counts, default=[1, 100, 10000], help="Comma-separated synthetic corpus sizes")
+    parser.add_argument("--model-tier", choices=MODEL_TIERS, default=MODEL_TIER)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--n-process", type=int, default=1, help="Processes for spaCy parsing in the corpus suite")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report here as well as to stdout")
+    parser.add_argument("--baseline", help="Compare against this earlier report")
+    parser.add_argument("--save-baseline", help="Write the report here, to compare later runs against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    check_offline(args.model_tier)
+    report = {
+        "environment": environment(args.model_tier),
+        "length_scaling": [run_isolated(measure_length, scale, args.model_tier, args.seed) for scale in args.lengths],
+        "corpus_scaling": [run_isolated(measure_corpus, count, args.model_tier, args.batch_size, args.n_process, args.seed)
+                           for count in args.documents],
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f), args.tolerance)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    if any(entry["regression"] for entry in report.get("comparison", [])):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import instrumentation
+from context_packer import ContextPacker
+from conversation import ConversationLedger
+from summarizer import BackgroundSummarizer, summary_message
+
+TRUNCATIONS = ("remove", "summarize", "relevance", "trim")  # trim needs a TokenLedger history
+TRUNCATION_NOTICES = {
+    "remove": "Removing oldest messages.",
+    "summarize": "Removing oldest messages.",
+    "relevance": "Removing the least relevant messages.",
+    "trim": "Removing the oldest tokens.",
+}
+
+class ChatContext:
+    """One conversation's history and the context policy the chat examples apply on every turn.
+
+    `prepare` adds the user's message and, if the history no longer fits in
+    `max_tokens`, brings it back within budget by `truncation`: removing the
+    oldest messages, summarizing them, keeping the ones most relevant to the
+    request (see ContextPacker), or cutting the oldest tokens, even partway
+    into a message (a TokenLedger history only). With `truncation=None` the
+    policy is chosen per call to `truncate` instead. If `archive`, a
+    MessageArchive, is given, every removed message goes there and the request
+    quotes the archived messages relevant to it within `recall_tokens`.
+    Replies and recall are reserved out of max_tokens throughout. Only while the policy is "summarize", `add_reply` also starts
+    summarizing the oldest span in the background while the user types, and
+    the next user message swaps the summary in if it has finished.
+    `summary_cache` (a SummaryCache) can be shared by many contexts.
+    `on_truncate` is called with the policy's name before truncating and
+    `on_summary` with each summary put in the history.
+    """
+
+    def __init__(self, summary_cache, archive, history=None, truncation="summarize", max_tokens=512,
+                 response_tokens=128, recall_tokens=64, context_packer=None, on_truncate=None, on_summary=None):
+        if truncation is not None and truncation not in TRUNCATIONS:
+            raise ValueError(f"Unknown truncation policy {truncation!r}, expected one of {', '.join(TRUNCATIONS)}")
+        self.history = ConversationLedger() if history is None else history
+        self.summary_cache = summary_cache
+        self.archive = archive
+        self.truncation = truncation
+        self.max_tokens = max_tokens
+        self.response_tokens = response_tokens
+        self.recall_tokens = recall_tokens
+        self.reserved_tokens = response_tokens + recall_tokens
+        self.context_packer = context_packer or ContextPacker()
+        self.on_truncate = on_truncate
+        self.on_summary = on_summary
+        self.summarizer = BackgroundSummarizer(summary_cache.summarize, max_tokens, self.reserved_tokens,
+                                               on_replace=self._archive)
+        self._snapshot = None  # The history before the latest user message, with its token counts
+
+    def fits(self):
+        """Returns whether the history fits in max_tokens with the reply and recall reserved."""
+        return self.history.fits(self.max_tokens, self.reserved_tokens)
+
+    def _archive(self, messages):
+        if self.archive is not None:
+            self.archive.add(messages)
+
+    def _summarized(self, summary):
+        if summary is not None and self.on_summary is not None:
+            self.on_summary(summary)
+
+    def apply_background_summary(self, wait=False):
+        """Swaps in the summary compacted in the background, if there is one and the policy is "summarize"."""
+        if self.truncation != "summarize":
+            self.summarizer.cancel()
+            return
+        self._summarized(self.summarizer.apply(self.history, wait=wait))
+
+    @instrumentation.timed()
+    def truncate_by_removing(self):
+        """Removes the oldest messages until the conversation history is short enough."""
+        self.summarizer.cancel()
+        self._archive(self.history.truncate(self.max_tokens, self.reserved_tokens))
+
+    @instrumentation.timed()
+    def truncate_by_summarizing(self):
+        """Summarizes the oldest messages until the conversation history, summary included, is short enough."""
+        self._summarized(self.summarizer.apply(self.history, wait=True))
+        messages_to_remove = self.history.truncate(self.max_tokens, self.reserved_tokens)
+        while messages_to_remove:
+            summary = self.summary_cache.summarize(messages_to_remove)
+            message = summary_message(summary)
+            num_tokens = self.history.count_tokens(message)
+            # Make room for the summary too; what else goes is summarized along with the rest.
+            more = self.history.truncate(self.max_tokens, self.reserved_tokens + num_tokens)
+            if not more:
+                self._archive(messages_to_remove)
+                self.history.insert(0, message, num_tokens)
+                self._summarized(summary)
+                break
+            messages_to_remove.extend(more)
+
+    @instrumentation.timed()
+    def truncate_by_relevance(self):
+        """Keeps the messages most relevant to the latest request that fit, dropping the rest."""
+        self.summarizer.cancel()
+        self._archive(self.context_packer.apply(self.history, self.max_tokens, self.reserved_tokens))
+
+    @instrumentation.timed()
+    def truncate_by_trimming(self):
+        """Removes the oldest tokens until the conversation history is short enough."""
+        self.summarizer.cancel()
+        self._archive(self.history.truncate_tokens(self.max_tokens, self.reserved_tokens))
+
+    def truncate(self, truncation=None):
+        """Brings the history back within budget by `truncation`, the context's policy by default."""
+        truncation = truncation or self.truncation
+        if truncation is None:
+            raise ValueError(f"No truncation policy chosen, expected one of {', '.join(TRUNCATIONS)}")
+        if self.on_truncate is not None:
+            self.on_truncate(truncation)
+        if truncation == "remove":
+            self.truncate_by_removing()
+        elif truncation == "summarize":
+            self.truncate_by_summarizing()
+        elif truncation == "relevance":
+            self.truncate_by_relevance()
+        elif truncation == "trim":
+            self.truncate_by_trimming()
+        else:
+            raise ValueError(f"Unknown truncation policy {truncation!r}, expected one of {', '.join(TRUNCATIONS)}")
+
+    def add_user_message(self, content):
+        """Adds the user's message, swapping in a background summary if it finished while they were typing."""
+        self._snapshot = [(message, self.history.tokens_at(i)) for i, message in enumerate(self.history)]
+        self.history.append({"role": "user", "content": content})
+        self.apply_background_summary(wait=False)
+
+    def request(self):
+        """Returns the messages to send: the history, with relevant archived messages quoted before the request."""
+        if self.archive is None:
+            return self.history.messages
+        recall_tokens = min(self.recall_tokens, self.max_tokens - self.response_tokens - self.history.prompt_tokens)
+        return self.archive.with_recall(self.history.messages, recall_tokens)
+
+    def prepare(self, content):
+        """Adds the user's message, truncates the history if it no longer fits and returns the request to send."""
+        self.add_user_message(content)
+        if not self.fits():
+            self.truncate()
+        return self.request()
+
+    def add_reply(self, content, num_tokens=None, tokens=None):
+        """Adds the response and, if the policy is "summarize", starts compacting the oldest messages in the background.
+
+        `tokens`, the reply's token ids, saves a TokenLedger history from encoding it again.
+        """
+        message = {"role": "assistant", "content": content}
+        if tokens is None:
+            self.history.append(message, num_tokens)
+        else:
+            self.history.append(message, num_tokens, tokens=tokens)
+        self._snapshot = None
+        if self.truncation == "summarize":
+            self.summarizer.start(self.history)
+
+    def discard_user_message(self):
+        """Puts the history back as it was before the latest user message, after its request failed.
+
+        The next turn then does not send two user messages in a row, and
+        whatever truncation or a background summary did to make room for the
+        failed request is undone. Messages it archived stay in the archive too.
+        """
+        snapshot, self._snapshot = self._snapshot, None
+        if snapshot is None:
+            return
+        self.summarizer.cancel()
+        self.history.clear()
+        for message, num_tokens in snapshot:
+            self.history.append(message, num_tokens)
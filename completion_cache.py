@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import instrumentation
+from core import LRUCache, evict_files, write_atomic
+
+class CompletionCache:
+    """Caches chat completion responses by a canonical hash of the request.
+
+    The key covers the model, the messages and any other parameters, with each
+    message reduced to its role, name and content and the content's whitespace
+    collapsed, so requests that differ only in spacing or key order share an
+    entry. Entries expire `ttl` seconds after they were stored. The newest
+    `max_entries` are kept in memory, least recently used evicted first, and if
+    `directory` is given every entry is also written there, one file per key, so
+    a restarted process or another worker on the same disk finds it. Past
+    `max_files` the least recently used files are removed.
+
+    Streamed responses are stored as the deltas they arrived in and replayed the
+    same way, so a cached answer goes through the caller's chunk path. Only
+    complete responses are stored. Each entry remembers how long the original
+    request took, which is counted as saved on every hit.
+    """
+
+    def __init__(self, ttl=24 * 3600, max_entries=256, directory=None, max_files=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_files = max_files
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._entries = LRUCache(max_entries)
+        self._written = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def normalize(messages):
+        """Returns messages as [role, name, content] lists, with runs of whitespace in the content collapsed."""
+        return [[message["role"], message.get("name") or "", " ".join(message["content"].split())]
+                for message in messages]
+
+    def key(self, messages, **params):
+        """Returns the cache key for a request of `messages` with params such as model and max_tokens."""
+        payload = json.dumps([self.normalize(messages), params], sort_keys=True, ensure_ascii=False,
+                             separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Returns the unexpired entry for `key` as {"chunks", "latency", "created"}, or None."""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if now - entry["created"] <= self.ttl:
+                return entry
+            self._entries.pop(key)
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if now - entry["created"] > self.ttl:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        try:
+            os.utime(path)  # Marks the file as recently used
+        except OSError:
+            pass
+        self._entries.put(key, entry)
+        return entry
+
+    def put(self, key, chunks, latency):
+        """Stores a complete response, as the list of its deltas, and how long its request took."""
+        entry = {"chunks": list(chunks), "latency": latency, "created": time.time()}
+        self._entries.put(key, entry)
+        if self.directory is not None:
+            write_atomic(self._path(key), json.dumps(entry, ensure_ascii=False))
+            self._written += 1
+            if self._written >= max(1, self.max_files // 16):
+                self.evict()
+
+    def evict(self):
+        """Removes expired files, then the least recently used ones if there are more than max_files."""
+        self._written = 0
+        evict_files(self.directory, max_files=self.max_files, ttl=self.ttl)
+
+    def _hit(self, entry):
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += entry["latency"]
+        instrumentation.count("completion_cache", result="hit")
+        instrumentation.count("completion_cache_saved_seconds", entry["latency"])
+
+    def _miss(self):
+        with self._lock:
+            self.misses += 1
+        instrumentation.count("completion_cache", result="miss")
+
+    def complete(self, completion, messages, **params):
+        """Returns completion(messages), or the cached response to an equivalent request.
+
+        `completion` takes a list of messages and returns the response text, e.g.
+        `openai_chat_completion`; `params` are whatever else shapes its answer,
+        such as model and max_tokens.
+        """
+        messages = list(messages)
+        key = self.key(messages, **params)
+        entry = self.get(key)
+        if entry is not None:
+            self._hit(entry)
+            return "".join(entry["chunks"])
+        self._miss()
+        start = time.perf_counter()
+        content = completion(messages)
+        self.put(key, [content], time.perf_counter() - start)
+        return content
+
+    async def stream(self, stream, messages, **params):
+        """Yields the deltas of stream(messages), or replays those of the cached response to an equivalent request.
+
+        `stream` takes a list of messages and returns an async iterator of
+        deltas, e.g. `StreamingClient.stream`.
+        """
+        messages = list(messages)
+        key = self.key(messages, **params)
+        entry = self.get(key)
+        if entry is not None:
+            self._hit(entry)
+            for content in entry["chunks"]:
+                yield content
+            return
+        self._miss()
+        start = time.perf_counter()
+        chunks = []
+        async for content in stream(messages):
+            chunks.append(content)
+            yield content
+        self.put(key, chunks, time.perf_counter() - start)
+
+    def stats(self):
+        """Returns the hit count, miss count, hit rate and seconds of requests saved so far."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "saved_seconds": self.saved_seconds,
+            }
@@ -0,0 +1,159 @@
+import hashlib
+import math
+import re
+from collections import OrderedDict, defaultdict
+
+import instrumentation
+from conversation import REPLY_PRIMING_TOKENS
+from keyword_generation import extract_keywords_with_rake, extract_keywords_with_yake
+
+EXTRACTORS = ("yake", "rake")
+KNAPSACK_CELLS = 1024  # Token budgets larger than this are packed in coarser steps, rounding sizes up
+_WORD = re.compile(r"\w+")
+
+def knapsack(weights, values, capacity):
+    """Returns the indices, in order, of the items with the greatest total value whose weights fit in capacity.
+
+    A 0/1 knapsack solved by dynamic programming over the capacity. Above
+    KNAPSACK_CELLS the weights are counted in coarser units, rounded up, so the
+    chosen items always fit and the table stays small.
+    """
+    unit = max(1, math.ceil(capacity / KNAPSACK_CELLS))
+    cells = capacity // unit
+    best = [0.0] * (cells + 1)
+    taken = []
+    for weight, value in zip(weights, values):
+        size = math.ceil(weight / unit)
+        took = bytearray(cells + 1)
+        if value > 0:
+            for c in range(cells, size - 1, -1):
+                candidate = best[c - size] + value
+                if candidate > best[c]:
+                    best[c] = candidate
+                    took[c] = 1
+        taken.append(took)
+    chosen = []
+    c = cells
+    for i in range(len(taken) - 1, -1, -1):
+        if taken[i][c]:
+            chosen.append(i)
+            c -= math.ceil(weights[i] / unit)
+    return chosen[::-1]
+
+class ContextPacker:
+    """Picks the messages of a conversation most relevant to its latest user turn that fit in a token budget.
+
+    Each message's keywords come from YAKE or RAKE (see keyword_generation.py)
+    and are split into terms, weighted by the rank of the phrase they come
+    from. Terms go in an inverted index keyed by a hash of the content, so a
+    message is only extracted once however many turns it stays in the history.
+    A message's relevance is the idf-weighted overlap of its terms with the
+    query's, plus `recency_weight` for how recent it is; the most valuable set
+    that fits is then chosen with a knapsack over token counts, keeping the
+    newest `keep_recent` messages and any system messages regardless.
+    """
+
+    def __init__(self, extractor="yake", max_keywords=10, recency_weight=0.1, keep_recent=1, max_entries=10000):
+        if extractor not in EXTRACTORS:
+            raise ValueError(f"Unknown extractor {extractor!r}, expected one of {', '.join(EXTRACTORS)}")
+        self.extractor = extractor
+        self.max_keywords = max_keywords
+        self.recency_weight = recency_weight
+        self.keep_recent = keep_recent
+        self.max_entries = max_entries
+        self._terms = OrderedDict()  # Content hash -> {term: weight}, least recently used first
+        self._postings = defaultdict(dict)  # Term -> {content hash: weight}
+
+    def keywords(self, content):
+        """Returns the content's keyword phrases, best first."""
+        if self.extractor == "yake":
+            keywords = [phrase for phrase, _ in extract_keywords_with_yake(content)]
+        else:
+            keywords = [phrase for _, phrase in extract_keywords_with_rake(content)]
+        return keywords[:self.max_keywords]
+
+    def extract_terms(self, content):
+        """Returns {term: weight} for content; a phrase ranked r (from 0) gives each of its words 1 / (r + 1)."""
+        terms = defaultdict(float)
+        for rank, phrase in enumerate(self.keywords(content)):
+            for word in _WORD.findall(phrase.lower()):
+                terms[word] += 1 / (rank + 1)
+        if not terms:
+            for word in _WORD.findall(content.lower()):
+                terms[word] = 1.0
+        return dict(terms)
+
+    def index(self, content):
+        """Indexes content if it is not indexed yet and returns its hash."""
+        key = hashlib.sha1(content.encode("utf-8")).hexdigest()
+        if key in self._terms:
+            self._terms.move_to_end(key)
+            return key
+        terms = self.extract_terms(content)
+        self._terms[key] = terms
+        for term, weight in terms.items():
+            self._postings[term][key] = weight
+        while len(self._terms) > self.max_entries:
+            old_key, old_terms = self._terms.popitem(last=False)
+            for term in old_terms:
+                postings = self._postings[term]
+                postings.pop(old_key, None)
+                if not postings:
+                    del self._postings[term]
+        return key
+
+    def relevance(self, contents, query):
+        """Returns each content's relevance to the query, scaled so the most relevant one scores 1."""
+        keys = [self.index(content) for content in contents]
+        present = set(keys)
+        query_terms = self.extract_terms(query)
+        scores = defaultdict(float)
+        for term, query_weight in query_terms.items():
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            matches = [(key, weight) for key, weight in postings.items() if key in present]
+            if not matches:
+                continue
+            idf = math.log(1 + len(present) / len(matches))
+            for key, weight in matches:
+                scores[key] += query_weight * weight * idf
+        top = max(scores.values(), default=0)
+        return [scores[key] / top if top else 0.0 for key in keys]
+
+    @instrumentation.timed("context_packing")
+    def pack(self, messages, counts, budget):
+        """Returns the indices of the messages to keep, oldest first, so their counts fit in budget.
+
+        The query is the newest user message. If the messages that are always
+        kept do not fit, only the newest of them that do are kept.
+        """
+        n = len(messages)
+        forced = set(range(max(0, n - self.keep_recent), n))
+        forced.update(i for i, message in enumerate(messages) if message["role"] == "system")
+        forced_tokens = sum(counts[i] for i in forced)
+        if forced_tokens > budget:
+            kept, used = [], 0
+            for i in sorted(forced, reverse=True):
+                if used + counts[i] > budget:
+                    break
+                kept.append(i)
+                used += counts[i]
+            return kept[::-1]
+        query = next((message["content"] for message in reversed(messages) if message["role"] == "user"), "")
+        candidates = [i for i in range(n) if i not in forced]
+        relevance = self.relevance([messages[i]["content"] for i in candidates], query)
+        values = [score + self.recency_weight * (i + 1) / n for i, score in zip(candidates, relevance)]
+        chosen = knapsack([counts[i] for i in candidates], values, budget - forced_tokens)
+        return sorted(forced.union(candidates[j] for j in chosen))
+
+    def apply(self, ledger, max_tokens, reserve_tokens=0):
+        """Drops the messages of a ConversationLedger or TokenLedger that pack() leaves out.
+
+        Returns the dropped messages, oldest first.
+        """
+        messages = list(ledger)
+        counts = [ledger.tokens_at(i) for i in range(len(messages))]
+        keep = set(self.pack(messages, counts, max_tokens - reserve_tokens - REPLY_PRIMING_TOKENS))
+        removed = [ledger.pop(i) for i in range(len(messages) - 1, -1, -1) if i not in keep]
+        return removed[::-1]
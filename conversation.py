@@ -0,0 +1,438 @@
+import re
+import sys
+from array import array
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Mapping
+from itertools import accumulate
+
+import core
+import instrumentation
+
+MODEL = "gpt-3.5-turbo"
+
+# Per-message framing the chat format adds around each message, as (tokens per
+# message, tokens per name). Every reply is also primed with REPLY_PRIMING_TOKENS.
+MESSAGE_OVERHEAD = {
+    "gpt-3.5-turbo-0301": (4, -1),
+    "gpt-3.5-turbo": (3, 1),
+    "gpt-4": (3, 1),
+}
+REPLY_PRIMING_TOKENS = 3
+
+# A single space between a non-space character and a letter always starts a new
+# pre-token in the GPT encodings, so text can be split there and counted in parts.
+_TOKEN_BOUNDARY = re.compile(r"(?<=\S) (?=[^\W\d_])")
+
+def get_encoding(model=MODEL):
+    """Returns the tiktoken encoding for a model, resolving it only once per process."""
+    return core.get_encoding(model)
+
+def message_overhead(model=MODEL):
+    """Returns (tokens per message, tokens per name) for a model."""
+    if model in MESSAGE_OVERHEAD:
+        return MESSAGE_OVERHEAD[model]
+    for prefix in ("gpt-3.5-turbo", "gpt-4"):
+        if model.startswith(prefix):
+            return MESSAGE_OVERHEAD[prefix]
+    return MESSAGE_OVERHEAD[MODEL]
+
+@instrumentation.timed()
+def num_tokens_from_message(message, model=MODEL):
+    """Returns the number of tokens a single message uses, including its chat framing."""
+    encoding = get_encoding(model)
+    tokens_per_message, tokens_per_name = message_overhead(model)
+    num_tokens = tokens_per_message
+    for key, value in message.items():
+        num_tokens += len(encoding.encode(value))
+        if key == "name":
+            num_tokens += tokens_per_name
+    return num_tokens
+
+@instrumentation.timed()
+def num_tokens_from_messages(messages, model=MODEL):
+    """Returns the number of tokens used by a list of messages."""
+    num_tokens = 0
+    for message in messages:
+        num_tokens += num_tokens_from_message(message, model)
+    return num_tokens
+
+class StreamingTokenCounter:
+    """Counts the tokens of text that arrives in pieces, such as a streamed reply.
+
+    Completed words are encoded as soon as a boundary after them arrives and
+    only the unfinished tail is held back, so the reply is never re-encoded as
+    a whole and the count matches encoding the full text at once.
+    """
+
+    def __init__(self, model=MODEL):
+        self.model = model
+        self._tokens = 0
+        self._ids = array("I")
+        self._pending = ""
+
+    def add(self, delta):
+        """Adds the next piece of text."""
+        pending = self._pending + delta
+        cut = 0
+        for match in _TOKEN_BOUNDARY.finditer(pending):
+            cut = match.start()
+        if cut:
+            ids = get_encoding(self.model).encode(pending[:cut])
+            self._ids.extend(ids)
+            self._tokens += len(ids)
+            pending = pending[cut:]
+        self._pending = pending
+
+    @property
+    def total(self):
+        """Returns the number of tokens in the text so far."""
+        if not self._pending:
+            return self._tokens
+        return self._tokens + len(get_encoding(self.model).encode(self._pending))
+
+    @property
+    def tokens(self):
+        """Returns the token ids of the text so far, as an array('I')."""
+        ids = array("I", self._ids)
+        if self._pending:
+            ids.extend(get_encoding(self.model).encode(self._pending))
+        return ids
+
+    def message_tokens(self, role="assistant"):
+        """Returns the tokens a message with this text as its content uses, including its chat framing."""
+        tokens_per_message, _ = message_overhead(self.model)
+        return tokens_per_message + len(get_encoding(self.model).encode(role)) + self.total
+
+def plan_truncation(counts, max_tokens, reserve_tokens=0):
+    """Returns how many of the oldest messages must be dropped for the rest to fit.
+
+    `counts` are per-message token counts, oldest first. The remaining messages,
+    the reply priming and `reserve_tokens` for the completion must fit in
+    `max_tokens`. The cut point is found with one pass of prefix sums and a
+    binary search instead of re-counting after every removal.
+    """
+    prefix = [0]
+    prefix.extend(accumulate(counts))
+    budget = max_tokens - reserve_tokens - REPLY_PRIMING_TOKENS
+    # The smallest k with prefix[-1] - prefix[k] <= budget.
+    return min(bisect_left(prefix, prefix[-1] - budget), len(prefix) - 1)
+
+class ConversationLedger:
+    """A conversation history that caches each message's token count and keeps a running total.
+
+    Every message is encoded exactly once, when it enters the ledger, so appends,
+    pops and inserts only adjust `total_tokens` instead of re-counting the history.
+    Messages are held in a deque so evicting the oldest ones is cheap.
+    """
+
+    def __init__(self, messages=(), model=MODEL):
+        self.model = model
+        self._messages = deque()
+        self._counts = deque()
+        self.total_tokens = 0
+        for message in messages:
+            self.append(message)
+
+    @property
+    def encoding(self):
+        """Returns the tiktoken encoding, loading it on first use."""
+        return get_encoding(self.model)
+
+    def count_tokens(self, message):
+        """Returns the number of tokens a single message uses, including its chat framing."""
+        return num_tokens_from_message(message, self.model)
+
+    def append(self, message, num_tokens=None):
+        """Adds a message to the end of the history. Pass `num_tokens` if it is already known."""
+        if num_tokens is None:
+            num_tokens = self.count_tokens(message)
+        self._messages.append(message)
+        self._counts.append(num_tokens)
+        self.total_tokens += num_tokens
+
+    def insert(self, index, message, num_tokens=None):
+        """Inserts a message before `index`."""
+        if num_tokens is None:
+            num_tokens = self.count_tokens(message)
+        self._messages.insert(index, message)
+        self._counts.insert(index, num_tokens)
+        self.total_tokens += num_tokens
+
+    def pop(self, index=-1):
+        """Removes and returns the message at `index`."""
+        if index == 0:
+            self.total_tokens -= self._counts.popleft()
+            return self._messages.popleft()
+        message = self._messages[index]
+        self.total_tokens -= self._counts[index]
+        del self._messages[index]
+        del self._counts[index]
+        return message
+
+    def clear(self):
+        """Removes every message."""
+        self._messages.clear()
+        self._counts.clear()
+        self.total_tokens = 0
+
+    @property
+    def prompt_tokens(self):
+        """Returns the tokens a request with this history uses, including the reply priming."""
+        return self.total_tokens + REPLY_PRIMING_TOKENS
+
+    def fits(self, max_tokens, reserve_tokens=0):
+        """Returns whether the history and `reserve_tokens` for the reply fit in `max_tokens`."""
+        return self.prompt_tokens + reserve_tokens <= max_tokens
+
+    def plan_truncation(self, max_tokens, reserve_tokens=0):
+        """Returns how many of the oldest messages must be dropped for the history to fit."""
+        return plan_truncation(self._counts, max_tokens, reserve_tokens)
+
+    def truncate(self, max_tokens, reserve_tokens=0):
+        """Drops the oldest messages until the history fits and returns them, oldest first."""
+        num_to_remove = self.plan_truncation(max_tokens, reserve_tokens)
+        return [self.pop(0) for _ in range(num_to_remove)]
+
+    def replace_oldest(self, count, message, num_tokens=None):
+        """Replaces the oldest `count` messages with a single message and returns the removed ones."""
+        if num_tokens is None:
+            num_tokens = self.count_tokens(message)
+        removed = [self.pop(0) for _ in range(count)]
+        self.insert(0, message, num_tokens)
+        return removed
+
+    def tokens_at(self, index):
+        """Returns the cached token count of the message at `index`."""
+        return self._counts[index]
+
+    @property
+    def messages(self):
+        """Returns the history as a plain list of message dicts, ready to send to the API."""
+        return list(self._messages)
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+class TokenMessage(Mapping):
+    """A message held as token ids: an interned role, an optional name and the content's tokens.
+
+    `num_tokens` is the message's full count, chat framing included, so it
+    never has to be re-derived. The record reads like the dict it came from:
+    message["content"] decodes the tokens on demand, and dict(message) gives
+    the plain dict the API expects. The model whose encoding decodes the
+    tokens is a class attribute, not stored per message; a TokenLedger for
+    another model makes its records with token_message_class(model).
+    """
+
+    __slots__ = ("role", "name", "tokens", "num_tokens")
+    model = MODEL
+
+    def __init__(self, role, tokens, num_tokens, name=None):
+        self.role = role
+        self.name = name
+        self.tokens = tokens
+        self.num_tokens = num_tokens
+
+    @property
+    def content(self):
+        """Returns the content, decoded from its tokens."""
+        return get_encoding(self.model).decode(self.tokens)
+
+    def __getitem__(self, key):
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        if key == "name" and self.name is not None:
+            return self.name
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield "role"
+        yield "content"
+        if self.name is not None:
+            yield "name"
+
+    def __len__(self):
+        return 2 if self.name is None else 3
+
+    def __repr__(self):
+        return repr(dict(self))
+
+_token_message_classes = {MODEL: TokenMessage}
+
+def token_message_class(model=MODEL):
+    """Returns the TokenMessage class whose records decode with `model`'s encoding."""
+    cls = _token_message_classes.get(model)
+    if cls is None:
+        cls = _token_message_classes[model] = type("TokenMessage", (TokenMessage,), {"__slots__": (), "model": model})
+    return cls
+
+class TokenLedger:
+    """A ConversationLedger that stores each message as a TokenMessage instead of a dict of strings.
+
+    Content is kept as an array('I') of token ids (4 bytes a token) and roles
+    are interned, so a long session holds no strings and no per-message dicts,
+    and nothing is ever encoded twice. Messages are decoded only when they are
+    read: `messages` builds the dicts for a request, and `pop` and `truncate`
+    return dicts. Besides the ConversationLedger interface, `truncate_tokens`
+    cuts the history at an exact token offset, even partway into a message.
+    """
+
+    def __init__(self, messages=(), model=MODEL):
+        self.model = model
+        self._message_class = token_message_class(model)
+        self._records = deque()
+        self.total_tokens = 0
+        self._role_tokens = {}
+        for message in messages:
+            self.append(message)
+
+    @property
+    def encoding(self):
+        """Returns the tiktoken encoding, loading it on first use."""
+        return get_encoding(self.model)
+
+    def record(self, message, tokens=None):
+        """Returns `message` as a TokenMessage, encoding its content unless its token ids are given."""
+        if type(message) is self._message_class:
+            return message
+        if isinstance(message, TokenMessage) and tokens is None:
+            message = dict(message)  # From a ledger for another model, so its token ids do not apply here
+        if tokens is None:
+            tokens = self.encoding.encode(message["content"])
+        tokens = tokens if isinstance(tokens, array) else array("I", tokens)
+        role = sys.intern(message["role"])
+        role_tokens = self._role_tokens.get(role)
+        if role_tokens is None:
+            role_tokens = self._role_tokens[role] = len(self.encoding.encode(role))
+        tokens_per_message, tokens_per_name = message_overhead(self.model)
+        num_tokens = tokens_per_message + role_tokens + len(tokens)
+        name = message.get("name")
+        if name is not None:
+            num_tokens += len(self.encoding.encode(name)) + tokens_per_name
+        return self._message_class(role, tokens, num_tokens, name)
+
+    def _checked_record(self, message, num_tokens, tokens):
+        record = self.record(message, tokens)
+        if num_tokens is not None and num_tokens != record.num_tokens:
+            raise ValueError(f"Message has {record.num_tokens} tokens, not the {num_tokens} given")
+        return record
+
+    def count_tokens(self, message):
+        """Returns the number of tokens a single message uses, including its chat framing."""
+        return self.record(message).num_tokens
+
+    def append(self, message, num_tokens=None, tokens=None):
+        """Adds a message to the end of the history.
+
+        Pass its content's token ids as `tokens` if they are already known, e.g.
+        from a StreamingTokenCounter. The count always comes from the token ids;
+        `num_tokens`, as passed to ConversationLedger, must agree with it or
+        ValueError is raised.
+        """
+        record = self._checked_record(message, num_tokens, tokens)
+        self._records.append(record)
+        self.total_tokens += record.num_tokens
+
+    def insert(self, index, message, num_tokens=None, tokens=None):
+        """Inserts a message before `index`, checking `num_tokens` as append does."""
+        record = self._checked_record(message, num_tokens, tokens)
+        self._records.insert(index, record)
+        self.total_tokens += record.num_tokens
+
+    def pop(self, index=-1):
+        """Removes the message at `index` and returns it as a dict."""
+        record = self._records.popleft() if index == 0 else self._records[index]
+        if index != 0:
+            del self._records[index]
+        self.total_tokens -= record.num_tokens
+        return dict(record)
+
+    def clear(self):
+        """Removes every message."""
+        self._records.clear()
+        self.total_tokens = 0
+
+    @property
+    def prompt_tokens(self):
+        """Returns the tokens a request with this history uses, including the reply priming."""
+        return self.total_tokens + REPLY_PRIMING_TOKENS
+
+    def fits(self, max_tokens, reserve_tokens=0):
+        """Returns whether the history and `reserve_tokens` for the reply fit in `max_tokens`."""
+        return self.prompt_tokens + reserve_tokens <= max_tokens
+
+    def plan_truncation(self, max_tokens, reserve_tokens=0):
+        """Returns how many of the oldest messages must be dropped for the history to fit."""
+        return plan_truncation([record.num_tokens for record in self._records], max_tokens, reserve_tokens)
+
+    def truncate(self, max_tokens, reserve_tokens=0):
+        """Drops the oldest messages until the history fits and returns them, oldest first."""
+        num_to_remove = self.plan_truncation(max_tokens, reserve_tokens)
+        return [self.pop(0) for _ in range(num_to_remove)]
+
+    def truncate_tokens(self, max_tokens, reserve_tokens=0):
+        """Drops the oldest tokens until the history fits and returns what was removed, oldest first.
+
+        Whole messages go first; if that would remove more than needed, the
+        oldest remaining message loses just the head of its content instead,
+        sliced from its token ids without re-encoding, and that head is
+        returned as a message of its own. The cut is moved forward to the next
+        UTF-8 character boundary, so it may remove a token or two more.
+        """
+        excess = self.prompt_tokens + reserve_tokens - max_tokens
+        removed = []
+        while excess > 0 and self._records:
+            record = self._records[0]
+            cut = self._character_start(record.tokens, excess)
+            if cut >= len(record.tokens):
+                removed.append(self.pop(0))
+                excess -= record.num_tokens
+                continue
+            head = self._message_class(record.role, record.tokens[:cut], 0, record.name)
+            self._records[0] = self._message_class(record.role, record.tokens[cut:], record.num_tokens - cut, record.name)
+            self.total_tokens -= cut
+            removed.append(dict(head))
+            excess -= cut
+        return removed
+
+    def _character_start(self, tokens, index):
+        # Tokens are byte sequences, so one can start partway into a multi-byte
+        # character; skip those so the kept content still decodes cleanly.
+        encoding = self.encoding
+        while index < len(tokens) and 0x80 <= encoding.decode_single_token_bytes(tokens[index])[0] < 0xC0:
+            index += 1
+        return index
+
+    def replace_oldest(self, count, message, num_tokens=None):
+        """Replaces the oldest `count` messages with a single message and returns the removed ones."""
+        record = self._checked_record(message, num_tokens, None)  # Before anything is removed
+        removed = [self.pop(0) for _ in range(count)]
+        self.insert(0, record)
+        return removed
+
+    def tokens_at(self, index):
+        """Returns the token count of the message at `index`."""
+        return self._records[index].num_tokens
+
+    @property
+    def messages(self):
+        """Returns the history as a plain list of message dicts, decoding each one, ready to send to the API."""
+        return [dict(record) for record in self._records]
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __getitem__(self, index):
+        return self._records[index]
@@ -0,0 +1,151 @@
+import importlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+_encodings = {}
+_spacy_models = {}
+_nltk_resources = set()
+
+# Where each NLTK resource lives under nltk_data, for nltk.data.find.
+NLTK_RESOURCE_PATHS = {
+    "stopwords": "corpora/stopwords",
+    "punkt": "tokenizers/punkt",
+    "punkt_tab": "tokenizers/punkt_tab",  # What sent_tokenize loads on nltk 3.9 and later
+}
+
+def require(module_name, package=None):
+    """Imports a module on first use, with an install hint if it is missing."""
+    try:
+        return importlib.import_module(module_name)
+    except ImportError as e:
+        package = package or module_name.split(".")[0]
+        raise ImportError(f"{module_name} is required for this feature. Install it with: pip install {package}") from e
+
+def get_encoding(model):
+    """Returns the tiktoken encoding for a model, loading it only once per process."""
+    encoding = _encodings.get(model)
+    if encoding is None:
+        tiktoken = require("tiktoken")
+        encoding = tiktoken.encoding_for_model(model)
+        _encodings[model] = encoding
+    return encoding
+
+def get_spacy_model(name, **kwargs):
+    """Returns a loaded spaCy pipeline, loading it only once per process."""
+    key = (name, tuple(sorted(kwargs.items())))
+    nlp = _spacy_models.get(key)
+    if nlp is None:
+        spacy = require("spacy")
+        try:
+            nlp = spacy.load(name, **kwargs)
+        except OSError as e:
+            raise OSError(f"spaCy model {name} is not installed. Install it with: python -m spacy download {name}") from e
+        _spacy_models[key] = nlp
+    return nlp
+
+def ensure_nltk_data(*resources):
+    """Makes sure NLTK data is available, downloading it only if it is not installed yet."""
+    nltk = require("nltk")
+    for resource in resources:
+        if resource in _nltk_resources:
+            continue
+        path = NLTK_RESOURCE_PATHS.get(resource, resource)
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            nltk.download(resource, quiet=True)
+            nltk.data.find(path)
+        _nltk_resources.add(resource)
+
+def write_atomic(path, data):
+    """Writes str or bytes to `path` through a temporary file, so readers in any process see all of it or none."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class LRUCache:
+    """A thread-safe in-memory map of at most `max_entries` values, evicting the least recently used first."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value for `key`, marking it as recently used, or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Stores a value under `key`, evicting the least recently used values past max_entries."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """Removes `key` if it is present."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+def evict_files(directory, max_files=None, max_bytes=None, ttl=None, keep=1.0):
+    """Removes cache files under `directory` and returns how many were removed.
+
+    Files older than `ttl` seconds go first. Then, if there are more than
+    `max_files` files or `max_bytes` bytes, the least recently used go until
+    `keep` times those limits are left. Files are ranked by modification time,
+    so a cache touches (os.utime) the ones it reads. Temporary files of
+    write_atomic younger than an hour are still being written and are kept.
+    Where fcntl is available one process evicts a directory at a time.
+    """
+    with open(os.path.join(directory, ".lock"), "a") as lock:
+        try:
+            import fcntl  # Unix only; elsewhere concurrent evictions may both remove the same files, which is harmless
+        except ImportError:
+            pass
+        else:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        now = time.time()
+        entries = []
+        for root, _, names in os.walk(directory):
+            for name in names:
+                if name == ".lock":
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith(".tmp") and now - stat.st_mtime < 3600:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        count, total = len(entries), sum(size for _, size, _ in entries)
+        over = (max_files is not None and count > max_files) or (max_bytes is not None and total > max_bytes)
+        removed = 0
+        for mtime, size, path in entries:
+            expired = ttl is not None and now - mtime > ttl
+            excess = over and ((max_files is not None and count > keep * max_files) or
+                               (max_bytes is not None and total > keep * max_bytes))
+            if not expired and not excess:
+                break  # Oldest first, so nothing later is expired or in excess either
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            count -= 1
+            total -= size
+            removed += 1
+        return removed
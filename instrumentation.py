@@ -0,0 +1,257 @@
+"""Timers and counters for the hot paths, exported as JSON lines or Prometheus text.
+
+Recording is off by default and costs one attribute check per instrumented
+call until it is enabled. The chat scripts turn it on from the environment:
+
+    LLM_METRICS=metrics.jsonl python basic_context_management.py   # or metrics.prom for Prometheus text
+    LLM_PROFILE=profile.folded python response_streaming.py         # sample stacks for this session
+
+The metrics are written when the process exits; the profile is written as
+folded stacks, ready for flamegraph.pl or speedscope.
+"""
+import atexit
+import contextlib
+import functools
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Timer histogram bounds, in seconds
+_NULL_TIMER = contextlib.nullcontext()
+
+class Timer:
+    """Times the code in a `with` block and records it in a registry."""
+
+    __slots__ = ("registry", "name", "labels", "start")
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+class Metrics:
+    """A registry of timers and counters, each series identified by a name and labels.
+
+    Timers keep a count, sum, min, max and a histogram over BUCKETS; counters
+    keep a running total. Nothing is recorded while `enabled` is false, so
+    instrumented code can stay in place in production.
+    """
+
+    def __init__(self, enabled=False, buckets=BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._timers = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """Drops everything recorded so far."""
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+
+    def observe(self, name, seconds, **labels):
+        """Records one duration, in seconds."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._timers.get(key)
+            if series is None:
+                series = self._timers[key] = {"count": 0, "sum": 0.0, "min": math.inf, "max": 0.0,
+                                              "buckets": [0] * len(self.buckets)}
+            series["count"] += 1
+            series["sum"] += seconds
+            series["min"] = min(series["min"], seconds)
+            series["max"] = max(series["max"], seconds)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series["buckets"][i] += 1
+                    break
+
+    def count(self, name, value=1, **labels):
+        """Adds `value` to a counter."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def timer(self, name, **labels):
+        """Returns a context manager that records how long its block takes."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return Timer(self, name, labels)
+
+    def timed(self, name=None, **labels):
+        """Decorates a function so each call is recorded under `name` (the function's name by default)."""
+        def decorator(function):
+            series = name or function.__name__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(series, time.perf_counter() - start, **labels)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        """Returns every series recorded so far as a list of JSON-serializable dicts."""
+        with self._lock:
+            timers = [(key, dict(series, buckets=list(series["buckets"]))) for key, series in self._timers.items()]
+            counters = list(self._counters.items())
+        records = []
+        for (name, labels), series in timers:
+            records.append({"type": "timer", "name": name, "labels": dict(labels), **series})
+        for (name, labels), value in counters:
+            records.append({"type": "counter", "name": name, "labels": dict(labels), "value": value})
+        return records
+
+    def write_json_lines(self, output):
+        """Writes one JSON line per series, stamped with the current time."""
+        now = time.time()
+        for record in self.snapshot():
+            output.write(json.dumps({"time": now, **record}) + "\n")
+
+    def prometheus(self):
+        """Returns every series in the Prometheus text exposition format."""
+        lines = []
+        declared = set()
+        for record in sorted(self.snapshot(), key=lambda record: (record["type"], record["name"])):
+            if record["type"] == "timer":
+                metric = f"{record['name']}_seconds"
+                if metric not in declared:
+                    lines.append(f"# TYPE {metric} histogram")
+                    declared.add(metric)
+                cumulative = 0
+                for bound, bucket in zip(self.buckets, record["buckets"]):
+                    cumulative += bucket
+                    lines.append(f"{metric}_bucket{_labels(record['labels'], le=bound)} {cumulative}")
+                lines.append(f"{metric}_bucket{_labels(record['labels'], le='+Inf')} {record['count']}")
+                lines.append(f"{metric}_sum{_labels(record['labels'])} {record['sum']}")
+                lines.append(f"{metric}_count{_labels(record['labels'])} {record['count']}")
+            else:
+                metric = f"{record['name']}_total"
+                if metric not in declared:
+                    lines.append(f"# TYPE {metric} counter")
+                    declared.add(metric)
+                lines.append(f"{metric}{_labels(record['labels'])} {record['value']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Writes the metrics to a file: Prometheus text if it ends in .prom, JSON lines otherwise."""
+        if path.endswith(".prom"):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.prometheus())
+        else:
+            with open(path, "a", encoding="utf-8") as f:
+                self.write_json_lines(f)
+
+def _labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return "{" + pairs + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class SamplingProfiler:
+    """Samples one thread's Python stack every `interval` seconds from a background thread.
+
+    Samples are kept as counts of folded stacks (outermost frame first, frames
+    separated by ";"), the format flamegraph.pl and speedscope read. The profiled
+    code is not touched; the cost is one stack walk per interval on the sampler
+    thread. Profiles the thread that calls `start` unless `thread_id` is given.
+    """
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts sampling and returns the profiler."""
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops sampling."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def write_folded(self, path):
+        """Writes the samples as folded stacks, one "stack count" line each."""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+registry = Metrics()
+observe = registry.observe
+count = registry.count
+timer = registry.timer
+timed = registry.timed
+
+def configure_from_environment():
+    """Enables metrics if LLM_METRICS names an output file and profiling if LLM_PROFILE does, writing both at exit."""
+    metrics_path = os.environ.get("LLM_METRICS")
+    if metrics_path:
+        registry.enable()
+        atexit.register(registry.write, metrics_path)
+    profile_path = os.environ.get("LLM_PROFILE")
+    if profile_path:
+        profiler = SamplingProfiler().start()
+
+        def write_profile():
+            profiler.stop()
+            profiler.write_folded(profile_path)
+        atexit.register(write_profile)
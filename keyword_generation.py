@@ -1,100 +1,192 @@
 #!/usr/bin/env python
+import argparse
+import hashlib
+import importlib.metadata
+import io
+import json
 import os
+import re
 import sys
-import subprocess
-
-try:
-    import yake
-except:
-    print('yake not installed, installing now...')
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "yake"])
-    import yake
-
-try:
-    from fuzzywuzzy import fuzz
-except:
-    print('fuzzywuzzy not installed, installing now...')
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "fuzzywuzzy"])
-    from fuzzywuzzy import fuzz
-
-try:
-    import spacy
-except:
-    print('spacy not installed, installing now...')
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "spacy"])
-    subprocess.check_call([sys.executable, "-m", "spacy", "download", "en_core_web_lg"])
-    import spacy
-
-try:
-    from rake_nltk import Rake
-except:
-    print('rake_nltk not installed, installing now...')
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "rake_nltk"])
-    from rake_nltk import Rake
-
-try:
-    import pytextrank
-except:
-    print('pytextrank not installed, installing now...')
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "pytextrank"])
-    import pytextrank
-
-try:
-    import nltk
-    nltk.download('stopwords')
-    nltk.download('punkt')
-except:
-    print('nltk not installed, installing now...')
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "nltk"])
-    import nltk
-    nltk.download('stopwords')
-    nltk.download('punkt')
-
-try:
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "python-Levenshtein"])
-except:
-    print('python-Levenshtein not installed, installing now...')
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "python-Levenshtein"])
-
-nlp = spacy.load("en_core_web_lg")
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+from core import ensure_nltk_data, evict_files, get_spacy_model, require, write_atomic
+
+MODEL_TIERS = {
+    "sm": "en_core_web_sm",
+    "md": "en_core_web_md",
+    "lg": "en_core_web_lg",
+    "blank": None,  # No trained model: a blank English pipeline with rule-based tags and noun chunks
+}
+MODEL_TIER = "lg"
+RANKERS = ("textrank", "positionrank", "topicrank")
+EXTRACTORS = ("yake", "rake") + RANKERS
+RANKER_UNUSED_PIPES = ("ner", "senter")  # The rankers only need tags, lemmas, sentences and noun chunks
+RAKE_NLTK_DATA = ("stopwords", "punkt", "punkt_tab")
+RULE_ADJ_SUFFIXES = ("ous", "ful", "ive", "able", "ible", "al", "ic", "less", "ish")
+RULE_VERB_SUFFIXES = ("ed", "ize")
 matching_ratio = 80
+MIN_SUPPORT = 3  # Other extractors that must agree on a keyword for it to be consolidated
+DEDUPE_THRESHOLD = 95  # fuzz.partial_ratio above which consolidated keywords are near-duplicates
+WINDOW_CHARS = 100000  # Longest text the extractors see at once; well under spaCy's max_length
+WINDOW_OVERLAP_CHARS = 5000  # Trailing text repeated at the start of the next window
+MAX_MERGED_PHRASES = 10000  # Phrases kept per extractor while merging windows
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+CONSENSUS_BLOCK_SIZE = 1024  # Keywords scored per similarity-matrix batch
+DEDUPE_NGRAM = 4  # Character n-gram size of the fuzzy_deduplicate index
+
+_rankers = {}
+_extractors = {}
+_pipelines = {}
+_rake = threading.local()  # Rake keeps each call's results on the instance, so threads can't share one
+
+EXTRACTOR_LABELS = {
+    "yake": "Yake",
+    "rake": "Rake",
+    "textrank": "PyTextRank",
+    "positionrank": "PositionRank",
+    "topicrank": "TopicRank",
+}
+
+def set_model_tier(tier: str):
+    """Selects the model tier get_nlp loads from now on in this process."""
+    global MODEL_TIER
+    if tier not in MODEL_TIERS:
+        raise ValueError(f"Unknown model tier {tier!r}, expected one of {', '.join(MODEL_TIERS)}")
+    MODEL_TIER = tier
+
+def get_nlp():
+    """Returns the spaCy pipeline of the current model tier, loading it on first use.
+
+    Components the rankers do not use are excluded, so they are never loaded.
+    """
+    if MODEL_TIER == "blank":
+        return get_rule_pipeline()
+    return get_spacy_model(MODEL_TIERS[MODEL_TIER], exclude=RANKER_UNUSED_PIPES)
+
+def rule_tagger(doc):
+    """Tags a Doc with rough suffix rules and lowercase lemmas, for the blank tier."""
+    for token in doc:
+        lower = token.lower_
+        if token.is_punct:
+            pos = "PUNCT"
+        elif token.like_num:
+            pos = "NUM"
+        elif token.is_stop or not token.is_alpha:
+            pos = "X"
+        elif lower.endswith("ly"):
+            pos = "ADV"
+        elif lower.endswith(RULE_ADJ_SUFFIXES):
+            pos = "ADJ"
+        elif lower.endswith(RULE_VERB_SUFFIXES):
+            pos = "VERB"
+        elif token.is_title and not token.is_sent_start:
+            pos = "PROPN"
+        else:
+            pos = "NOUN"
+        token.pos_ = pos
+        token.lemma_ = lower
+    return doc
+
+def rule_noun_chunks(doclike):
+    """Yields (start, end, label) for runs of adjectives and nouns that end in a noun, for the blank tier."""
+    label = doclike.doc.vocab.strings.add("NP")
+    start = last_noun = None
+    for token in doclike:
+        if token.pos_ in ("ADJ", "NOUN", "PROPN"):
+            if start is None:
+                start = token.i
+            if token.pos_ != "ADJ":
+                last_noun = token.i
+            continue
+        if last_noun is not None:
+            yield start, last_noun + 1, label
+        start = last_noun = None
+    if last_noun is not None:
+        yield start, last_noun + 1, label
+
+def get_rule_pipeline():
+    """Returns the blank tier's pipeline: a sentencizer and rule_tagger, with rule_noun_chunks, built once per process."""
+    if "blank" not in _pipelines:
+        spacy = require("spacy")
+        if not spacy.language.Language.has_factory("keyword_rule_tagger"):
+            spacy.language.Language.component("keyword_rule_tagger", func=rule_tagger)
+        nlp = spacy.blank("en")
+        nlp.vocab.get_noun_chunks = rule_noun_chunks
+        nlp.add_pipe("sentencizer")
+        nlp.add_pipe("keyword_rule_tagger")
+        _pipelines["blank"] = nlp
+    return _pipelines["blank"]
+
+def get_rankers():
+    """Returns the PyTextRank rankers by name, built once per process."""
+    if not _rankers:
+        pytextrank = require("pytextrank")
+        _rankers["textrank"] = pytextrank.BaseTextRankFactory()
+        _rankers["positionrank"] = pytextrank.PositionRankFactory()
+        _rankers["topicrank"] = pytextrank.TopicRankFactory()
+    return _rankers
+
+@instrumentation.timed("keyword_parse")
+def parse(text: str):
+    """Tokenizes, tags and parses text once so every ranker can share the Doc."""
+    return get_nlp()(text, disable=RANKER_UNUSED_PIPES)
+
+def rank_phrases(doc, ranker: str) -> list:
+    """Runs one ranker over an already parsed Doc and returns its (phrase, rank) pairs."""
+    with instrumentation.timer("keyword_extractor", extractor=ranker):
+        get_rankers()[ranker](doc)
+        keywords = []
+        for phrase in doc._.phrases:
+            keywords.append((phrase.text, phrase.rank))
+    return keywords
+
+def extract_keywords_with_rankers(text, rankers=RANKERS) -> dict:
+    """Parses text (or takes a parsed Doc) once and runs each ranker over it."""
+    doc = parse(text) if isinstance(text, str) else text
+    return {ranker: rank_phrases(doc, ranker) for ranker in rankers}
+
+def get_yake_extractor():
+    """Returns the YAKE KeywordExtractor, built once per process."""
+    if "yake" not in _extractors:
+        _extractors["yake"] = require("yake").KeywordExtractor()
+    return _extractors["yake"]
+
+def get_rake():
+    """Returns this thread's Rake extractor, built once per thread; each call to it replaces its previous results."""
+    if not hasattr(_rake, "extractor"):
+        ensure_nltk_data(*RAKE_NLTK_DATA)
+        _rake.extractor = require("rake_nltk").Rake()
+    return _rake.extractor
 
+@instrumentation.timed("keyword_extractor", extractor="yake")
 def extract_keywords_with_yake(text: str) -> list:
-    kw_extractor = yake.KeywordExtractor()
+    kw_extractor = get_yake_extractor()
     keywords = kw_extractor.extract_keywords(text)
     return keywords
 
+@instrumentation.timed("keyword_extractor", extractor="rake")
 def extract_keywords_with_rake(text: str) -> list:
-    r = Rake()
+    r = get_rake()
     r.extract_keywords_from_text(text)
     keywords = r.get_ranked_phrases_with_scores()
     return keywords
 
-def extract_keywords_with_pytextrank(text: str) -> list:
-    nlp.add_pipe("textrank")
-    doc = nlp(text)
-    keywords = []
-    for phrase in doc._.phrases:
-        keywords.append((phrase.text, phrase.rank))
-    return keywords
+def extract_keywords_with_pytextrank(text) -> list:
+    return extract_keywords_with_rankers(text, ["textrank"])["textrank"]
 
-def extract_keywords_with_positionrank(text: str) -> list:
-    nlp.add_pipe("positionrank")
-    doc = nlp(text)
-    keywords = []
-    for phrase in doc._.phrases:
-        keywords.append((phrase.text, phrase.rank))
-    return keywords
+def extract_keywords_with_positionrank(text) -> list:
+    return extract_keywords_with_rankers(text, ["positionrank"])["positionrank"]
 
-def extract_keywords_with_topicrank(text: str) -> list:
-    nlp.add_pipe("topicrank")
-    doc = nlp(text)
-    keywords = []
-    for phrase in doc._.phrases:
-        keywords.append((phrase.text, phrase.rank))
-    return keywords
+def extract_keywords_with_topicrank(text) -> list:
+    return extract_keywords_with_rankers(text, ["topicrank"])["topicrank"]
 
 def fuzzy_matching(query, choices):
+    fuzz = require("fuzzywuzzy.fuzz", "fuzzywuzzy")
     best_score = 0
     best_match = None
     for choice in choices:
@@ -104,13 +196,785 @@ def fuzzy_matching(query, choices):
             best_match = choice
     return best_match, best_score
 
-def fuzzy_deduplicate(lst, match_threshold=98):
-    deduplicated_lst = []
-    for item in lst:
-        item_lower = item.lower()
-        if not any(fuzz.partial_ratio(item_lower, existing_item.lower()) >= match_threshold for existing_item in deduplicated_lst):
-            deduplicated_lst.append(item)
-    return deduplicated_lst
+def run_extractors(names, text: str, doc=None):
+    """Runs extractors on one text in this process and returns (results, timings) keyed by extractor.
+
+    Timings are in seconds. Rank-based extractors share one parse (`doc`, if it
+    is already parsed): it is counted in a lone ranker's time, or reported as
+    "parse" when several share it.
+    """
+    results, timings = {}, {}
+    rankers = [name for name in names if name in RANKERS]
+    if rankers:
+        start = time.perf_counter()
+        if doc is None:
+            doc = parse(text)
+        parse_time = time.perf_counter() - start
+        if len(rankers) > 1:
+            timings["parse"] = parse_time
+        for ranker in rankers:
+            start = time.perf_counter()
+            results[ranker] = rank_phrases(doc, ranker)
+            timings[ranker] = time.perf_counter() - start + (parse_time if len(rankers) == 1 else 0)
+    for name in names:
+        start = time.perf_counter()
+        if name == "yake":
+            results[name] = extract_keywords_with_yake(text)
+        elif name == "rake":
+            results[name] = extract_keywords_with_rake(text)
+        elif name not in RANKERS:
+            raise ValueError(f"Unknown extractor {name!r}, expected one of {', '.join(EXTRACTORS)}")
+        else:
+            continue
+        timings[name] = time.perf_counter() - start
+    return results, timings
+
+def warm_worker(extractors=EXTRACTORS, model_tier=None):
+    """Loads everything the given extractors need, so a worker process pays for it once."""
+    if model_tier is not None:
+        set_model_tier(model_tier)
+    if any(name in RANKERS for name in extractors):
+        get_nlp()
+        get_rankers()
+    if "yake" in extractors:
+        get_yake_extractor()
+    if "rake" in extractors:
+        get_rake()
+
+class ExtractorPool:
+    """Runs the keyword extractors for a text concurrently in warm worker processes.
+
+    By default the rank-based extractors run as one task that parses the text
+    once and runs every ranker on that Doc, alongside a YAKE task and a RAKE
+    task; with `share_parse` false each ranker is its own task and parses the
+    text itself, which can cut one document's latency when cores are idle but
+    triples the parsing work. Each task has its own workers, which load only
+    what that task needs when they start (the spaCy model and rankers, NLTK
+    data and RAKE, or YAKE), so no worker loads a model it does not use.
+    `max_workers` (one per task by default) is split between the tasks, the
+    rank-based ones getting any remainder; with fewer workers than tasks,
+    every extractor runs in one task per document instead, on one parse.
+    Workers load `model_tier` (the current MODEL_TIER by default).
+    """
+
+    def __init__(self, max_workers=None, extractors=EXTRACTORS, share_parse=True, model_tier=None):
+        self.extractors = tuple(extractors)
+        rankers = tuple(name for name in self.extractors if name in RANKERS)
+        self.tasks = [(name,) for name in self.extractors if name not in RANKERS]
+        if share_parse and rankers:
+            self.tasks.append(rankers)
+        else:
+            self.tasks.extend((ranker,) for ranker in rankers)
+        self.max_workers = max_workers or len(self.tasks)
+        if self.max_workers < len(self.tasks):
+            self.tasks = [self.extractors]  # Too few workers to split: each document is one task, on one parse
+        workers, remainder = divmod(self.max_workers, len(self.tasks))
+        task_workers = {task: workers for task in self.tasks}
+        slowest = [task for task in self.tasks if any(name in RANKERS for name in task)] or self.tasks
+        for n in range(remainder):
+            task_workers[slowest[n % len(slowest)]] += 1
+        self._executors = {task: ProcessPoolExecutor(task_workers[task], initializer=warm_worker,
+                                                     initargs=(task, model_tier or MODEL_TIER))
+                           for task in self.tasks}
+
+    def _submit(self, text):
+        return time.perf_counter(), [self._executors[task].submit(run_extractors, task, text) for task in self.tasks]
+
+    def _collect(self, start, futures):
+        results, timings = {}, {}
+        for future in futures:
+            task_results, task_timings = future.result()
+            results.update(task_results)
+            timings.update(task_timings)
+        # The workers' own metrics stay in their processes; record what they reported here.
+        for name, seconds in timings.items():
+            if name == "parse":
+                instrumentation.observe("keyword_parse", seconds)
+            else:
+                instrumentation.observe("keyword_extractor", seconds, extractor=name)
+        return {
+            "results": {name: results[name] for name in self.extractors},
+            "timings": timings,
+            "wall_time": time.perf_counter() - start,
+        }
+
+    def _submit_document(self, text):
+        # A text longer than WINDOW_CHARS is submitted one window at a time, as spaCy would reject it whole.
+        windows = [text] if len(text) <= WINDOW_CHARS else iter_windows(text)
+        return [(len(window), self._submit(window)) for window in windows]
+
+    def _collect_document(self, submissions):
+        if len(submissions) == 1:
+            return self._collect(*submissions[0][1])
+        merger, timings = KeywordMerger(self.extractors), {}
+        for window_chars, submitted in submissions:
+            extraction = self._collect(*submitted)
+            merger.add(extraction["results"], window_chars)
+            for name, seconds in extraction["timings"].items():
+                timings[name] = timings.get(name, 0.0) + seconds
+        start = submissions[0][1][0]
+        return {"results": merger.results(), "timings": timings, "wall_time": time.perf_counter() - start}
+
+    def extract(self, text: str) -> dict:
+        """Returns the results of every extractor for a text, their timings and the wall time, in seconds.
+
+        A text longer than WINDOW_CHARS is extracted window by window and the results merged, as
+        extract_keywords_streaming does.
+        """
+        return self._collect_document(self._submit_document(text))
+
+    def extract_documents(self, documents, max_pending=None):
+        """Yields (id, extraction) for a stream of (id, text) pairs in order, as extract() would return them.
+
+        Up to `max_pending` documents (the number of workers by default) are in flight at once.
+        """
+        max_pending = max_pending or self.max_workers
+        pending = deque()
+        for doc_id, text in documents:
+            pending.append((doc_id, self._submit_document(text)))
+            if len(pending) >= max_pending:
+                doc_id, submissions = pending.popleft()
+                yield doc_id, self._collect_document(submissions)
+        while pending:
+            doc_id, submissions = pending.popleft()
+            yield doc_id, self._collect_document(submissions)
+
+    def close(self):
+        """Shuts the worker processes down."""
+        for executor in self._executors.values():
+            executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def normalize_phrase(phrase: str) -> str:
+    """Returns the form of a phrase compared when deduplicating: lowercased, with single spaces."""
+    return " ".join(phrase.lower().split())
+
+def phrase_grams(form: str) -> set:
+    """Returns the distinct character n-grams of a normalized phrase."""
+    return {form[i:i + DEDUPE_NGRAM] for i in range(len(form) - DEDUPE_NGRAM + 1)}
+
+def fuzzy_clusters(lst, match_threshold=98, scores=None) -> list:
+    """Groups phrases whose lowercased fuzz.partial_ratio reaches `match_threshold`, best `scores` first.
+
+    Returns the clusters, each starting with its representative, in the list order of the representatives.
+    """
+    np = require("numpy")
+    process = require("rapidfuzz.process", "rapidfuzz")
+    rf_fuzz = require("rapidfuzz.fuzz", "rapidfuzz")
+    fuzz = require("fuzzywuzzy.fuzz", "fuzzywuzzy")
+
+    forms = [item.lower() for item in lst]
+    distinct = sorted(set(forms), key=lambda form: (len(form), form))
+    form_index = {form: i for i, form in enumerate(distinct)}
+    lengths = np.array([len(form) for form in distinct], dtype=np.int64)
+    grams = [phrase_grams(form) for form in distinct]
+    postings = defaultdict(list)  # n-gram -> phrases containing it
+    for i, form_grams in enumerate(grams):
+        for gram in form_grams:
+            postings[gram].append(i)
+    postings = {gram: np.array(ids, dtype=np.int64) for gram, ids in postings.items()}
+
+    # One point of slack below the threshold covers fuzz.partial_ratio's rounding.
+    cutoff = max(match_threshold - 1, 0)
+    max_edits = (2 * (1 - cutoff / 100) * lengths).astype(np.int64)
+    required = np.array([len(form_grams) for form_grams in grams], dtype=np.int64) - DEDUPE_NGRAM * max_edits
+    unfiltered = np.flatnonzero(required <= 0)  # Too short for the n-gram bound to rule anything out
+    no_ids = np.zeros(0, dtype=np.int64)
+
+    def candidates(i):
+        ids = np.concatenate([postings[gram] for gram in grams[i]]) if grams[i] else no_ids
+        ids, shared = np.unique(ids[leader_of[ids] >= 0], return_counts=True)
+        # The bound applies to the shorter phrase; partial_ratio takes its first argument, i, as that on a tie.
+        needed = np.where(lengths[ids] >= lengths[i], required[i], required[ids])
+        extra = unfiltered[lengths[unfiltered] <= lengths[i]]
+        if required[i] <= 0:
+            extra = np.concatenate([extra, np.flatnonzero(lengths >= lengths[i])])
+        ids = np.concatenate([ids[shared >= needed], extra[leader_of[extra] >= 0]])
+        return np.unique(ids)
+
+    order = range(len(lst))
+    if scores is not None:
+        order = sorted(order, key=lambda i: -scores.get(lst[i], 0))
+    leader_of = np.full(len(distinct), -1, dtype=np.int64)  # Phrase -> cluster it represents
+    cluster_of = {}  # Phrase -> cluster it joined
+    clusters = []
+    for item in order:
+        i = form_index[forms[item]]
+        # A repeated phrase joins its first occurrence's cluster unless it cannot match itself:
+        # fuzz.partial_ratio scores an empty phrase 0.
+        cluster = cluster_of.get(i) if distinct[i] and match_threshold <= 100 else None
+        if cluster is None:
+            ids = candidates(i)
+            if len(ids):
+                screened = process.cdist([distinct[i]], [distinct[j] for j in ids.tolist()],
+                                         scorer=rf_fuzz.partial_ratio, score_cutoff=cutoff)[0]
+                ids = ids[screened >= cutoff]
+                for j in ids[np.argsort(leader_of[ids])].tolist():
+                    if fuzz.partial_ratio(distinct[i], distinct[j]) >= match_threshold:
+                        cluster = int(leader_of[j])
+                        break
+            if cluster is None:
+                cluster = len(clusters)
+                leader_of[i] = cluster
+                clusters.append((item, []))
+            cluster_of[i] = cluster
+        clusters[cluster][1].append(item)
+    return [[lst[i] for i in members] for _, members in sorted(clusters)]
+
+def fuzzy_deduplicate(lst, match_threshold=98, scores=None):
+    """Returns the representative of each cluster of near-duplicate phrases, see fuzzy_clusters."""
+    return [cluster[0] for cluster in fuzzy_clusters(lst, match_threshold, scores)]
+
+def keyword_phrases(results: dict) -> list:
+    """Returns each extractor's keywords as plain strings, in EXTRACTORS order."""
+    return [
+        [keyword[1] if name == "rake" else keyword[0] for keyword in results[name]]  # Rake returns keyword second
+        for name in EXTRACTORS
+    ]
+
+def keyword_scores(results: dict) -> dict:
+    """Returns each keyword's combined score across extractors, higher is better.
+
+    Every extractor's scores are rescaled to 0-1 (YAKE's are inverted, since lower
+    is better there) and a keyword's best score from each extractor is summed.
+    """
+    combined = defaultdict(float)
+    for name, phrases in zip(EXTRACTORS, keyword_phrases(results)):
+        raw = [keyword[0] if name == "rake" else keyword[1] for keyword in results[name]]
+        if not raw:
+            continue
+        low, high = min(raw), max(raw)
+        best = {}
+        for phrase, score in zip(phrases, raw):
+            scaled = (score - low) / (high - low) if high > low else 1.0
+            if name == "yake":
+                scaled = 1 - scaled
+            best[phrase] = max(best.get(phrase, 0.0), scaled)
+        for phrase, scaled in best.items():
+            combined[phrase] += scaled
+    return dict(combined)
+
+def consensus_support(all_keywords: list, ratio: int = None) -> list:
+    """Returns, for every keyword of every extractor, how many other extractors have a keyword matching it.
+
+    A match is fuzz.ratio >= `ratio` (matching_ratio by default), as when each
+    keyword is compared with every keyword of every other extractor, but the
+    distinct keywords are only normalized and indexed once. They are sorted by
+    length, and each block of them is scored in one batch (a similarity matrix)
+    against just the keywords whose length can reach the threshold. Pairs that
+    pass are confirmed with fuzz.ratio itself, so results do not change.
+    """
+    np = require("numpy")
+    process = require("rapidfuzz.process", "rapidfuzz")
+    rf_fuzz = require("rapidfuzz.fuzz", "rapidfuzz")
+    fuzz = require("fuzzywuzzy.fuzz", "fuzzywuzzy")
+    ratio = matching_ratio if ratio is None else ratio
+
+    unique = sorted({keyword for keywords in all_keywords for keyword in keywords}, key=len)
+    index = {keyword: i for i, keyword in enumerate(unique)}
+    lengths = [len(keyword) for keyword in unique]
+    membership = np.zeros((len(unique), len(all_keywords)), dtype=bool)
+    for extractor, keywords in enumerate(all_keywords):
+        membership[[index[keyword] for keyword in keywords], extractor] = True
+
+    # The indel ratio rapidfuzz computes is never below fuzz.ratio, so one point of
+    # slack below the threshold covers rounding without losing any match.
+    cutoff = max(ratio - 1, 0)
+    bound = cutoff / 100
+    support = membership.copy()  # Every keyword matches itself
+    for start in range(0, len(unique), CONSENSUS_BLOCK_SIZE):
+        end = min(start + CONSENSUS_BLOCK_SIZE, len(unique))
+        # A ratio of at least `bound` needs 2 * min(len) / (len + len) >= bound.
+        lo, hi = 0, len(unique)
+        if bound > 0:
+            lo = bisect_left(lengths, lengths[start] * bound / (2 - bound))
+            hi = bisect_right(lengths, lengths[end - 1] * (2 - bound) / bound)
+        scores = process.cdist(unique[start:end], unique[lo:hi], scorer=rf_fuzz.ratio, score_cutoff=cutoff, workers=-1)
+        rows, columns = np.nonzero(scores)
+        rows += start
+        columns += lo
+        pairs = [(a, b) for a, b in zip(rows.tolist(), columns.tolist())
+                 if a != b and fuzz.ratio(unique[a], unique[b]) >= ratio]
+        if pairs:
+            a, b = np.array(pairs).T
+            np.logical_or.at(support, a, membership[b])
+
+    counts = support.sum(axis=1)
+    return [
+        [int(counts[index[keyword]] - support[index[keyword], extractor]) for keyword in keywords]
+        for extractor, keywords in enumerate(all_keywords)
+    ]
+
+def consolidate_keywords(all_keywords: list, min_support: int = MIN_SUPPORT, scores: dict = None) -> list:
+    """Returns the keywords that at least `min_support` other extractors agree on, fuzzily deduplicated.
+
+    With `scores` (see keyword_scores), the best-scoring variant of each near-duplicate is the one kept.
+    """
+    consolidated_keywords = []
+    for keywords, supports in zip(all_keywords, consensus_support(all_keywords)):
+        for keyword, support in zip(keywords, supports):
+            if support >= min_support:
+                consolidated_keywords.append(keyword)
+    return fuzzy_deduplicate(consolidated_keywords, match_threshold=DEDUPE_THRESHOLD, scores=scores)
+
+def package_version(name: str):
+    """Returns the installed version of a package, or None."""
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+def parse_config() -> dict:
+    """Returns what determines a parse besides the text: the model tier's pipeline and its versions."""
+    model = MODEL_TIERS[MODEL_TIER]
+    config = {"model": model or "blank:en", "spacy": package_version("spacy"), "excluded": list(RANKER_UNUSED_PIPES)}
+    if model is None:
+        config["rules"] = [list(RULE_ADJ_SUFFIXES), list(RULE_VERB_SUFFIXES)]
+    else:
+        config["model_version"] = package_version(model)
+    return config
+
+def extractor_config(name: str) -> dict:
+    """Returns what determines an extractor's results besides the text: its packages, versions and model."""
+    if name == "yake":
+        return {"extractor": name, "yake": package_version("yake")}
+    if name == "rake":
+        return {"extractor": name, "rake_nltk": package_version("rake_nltk"), "nltk": package_version("nltk")}
+    return {"extractor": name, "pytextrank": package_version("pytextrank"), **parse_config()}
+
+def consolidation_config() -> dict:
+    """Returns what determines the consolidated keywords besides the text."""
+    return {
+        "extractors": [extractor_config(name) for name in EXTRACTORS],
+        "matching_ratio": matching_ratio,
+        "min_support": MIN_SUPPORT,
+        "dedupe_threshold": DEDUPE_THRESHOLD,
+    }
+
+class KeywordCache:
+    """Caches extractor results, consolidated keywords and parsed Docs on disk by content.
+
+    Entries are keyed by a hash of the document text and of the configuration
+    that produced them (see extractor_config, consolidation_config and
+    parse_config), so unchanged documents are never extracted or parsed again
+    while a new model version or setting simply misses. Each entry is a file
+    under `directory`, written atomically, so concurrent workers can share the
+    directory. Past `max_bytes` the least recently used entries are removed,
+    under a file lock, until the cache is back to 90% of that.
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def document_hash(text: str) -> str:
+        """Returns the hash a document's entries are keyed by."""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def key(self, kind: str, document_hash: str, config) -> str:
+        """Returns the cache key for one kind of entry of a document under a configuration."""
+        payload = json.dumps([kind, document_hash, config], sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """Returns the bytes cached under `key`, or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # Marks the entry as recently used
+        except OSError:
+            pass
+        self.hits += 1
+        return data
+
+    def put(self, key, data: bytes):
+        """Stores bytes under `key`."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, data)
+        self._written += len(data)
+        if self._written >= self.max_bytes // 16:
+            self.evict()
+
+    def get_json(self, key):
+        """Returns the JSON value cached under `key`, or None."""
+        data = self.get(key)
+        return None if data is None else json.loads(data)
+
+    def put_json(self, key, value):
+        """Stores a JSON-serializable value under `key`."""
+        self.put(key, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    def evict(self):
+        """Removes the least recently used entries if the cache is over max_bytes."""
+        self._written = 0
+        evict_files(self.directory, max_bytes=self.max_bytes, keep=0.9)
+
+def cached_doc(text: str, cache):
+    """Returns the parsed Doc for text, from the cache if it holds one for the current model, else parsed and cached.
+
+    A cached Doc is rebuilt on a blank English vocabulary, so the model itself is not loaded.
+    """
+    key = cache.key("doc", cache.document_hash(text), parse_config())
+    data = cache.get(key)
+    if data is not None:
+        Doc = require("spacy.tokens", "spacy").Doc
+        vocab = get_rule_pipeline().vocab if MODEL_TIER == "blank" else get_spacy_model("blank:en").vocab
+        return Doc(vocab).from_bytes(data)
+    doc = parse(text)
+    cache.put(key, doc.to_bytes(exclude=["tensor", "user_data"]))
+    return doc
+
+def cached_consolidated(text: str, cache):
+    """Returns the cached consolidated keywords for text, or None."""
+    return cache.get_json(cache.key("consolidated", cache.document_hash(text), consolidation_config()))
+
+def extract_keywords_cached(text: str, cache):
+    """Returns (per-extractor results, consolidated keywords) for text, computing only what `cache` lacks.
+
+    Missing ranker results are computed from the cached parse when there is one.
+    """
+    document_hash = cache.document_hash(text)
+    results = {}
+    for name in EXTRACTORS:
+        keywords = cache.get_json(cache.key("results", document_hash, extractor_config(name)))
+        if keywords is not None:
+            results[name] = [tuple(keyword) for keyword in keywords]
+    missing = [name for name in EXTRACTORS if name not in results]
+    if missing:
+        doc = cached_doc(text, cache) if any(name in RANKERS for name in missing) else None
+        computed, _ = run_extractors(missing, text, doc)
+        for name, keywords in computed.items():
+            cache.put_json(cache.key("results", document_hash, extractor_config(name)), keywords)
+        results.update(computed)
+    consolidated = cached_consolidated(text, cache)
+    if consolidated is None:
+        consolidated = consolidate_keywords(keyword_phrases(results), scores=keyword_scores(results))
+        cache.put_json(cache.key("consolidated", document_hash, consolidation_config()), consolidated)
+    return results, consolidated
+
+def keyword_agreement(keywords: list, reference: list) -> dict:
+    """Returns the precision, recall and F1 of keywords against reference keywords, matched with fuzz.ratio >= matching_ratio."""
+    keywords = [normalize_phrase(keyword) for keyword in keywords]
+    reference = [normalize_phrase(keyword) for keyword in reference]
+    found = sum(1 for keyword in keywords if reference and fuzzy_matching(keyword, reference)[1] >= matching_ratio)
+    recalled = sum(1 for keyword in reference if keywords and fuzzy_matching(keyword, keywords)[1] >= matching_ratio)
+    precision = found / len(keywords) if keywords else 0.0
+    recall = recalled / len(reference) if reference else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+def peak_rss_mb() -> float:
+    """Returns this process's peak resident memory in MB, or None where the resource module is unavailable (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1 << 20) if sys.platform == "darwin" else max_rss / 1024  # Bytes on macOS, kilobytes elsewhere
+
+def measure_tier(tier: str, text: str) -> dict:
+    """Loads a model tier in this process and returns its consolidated keywords for text, with load and extraction times and memory."""
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    set_model_tier(tier)
+    warm_worker(RANKERS)
+    load_time = time.perf_counter() - start
+    model_rss = None if rss_before is None else peak_rss_mb() - rss_before
+    start = time.perf_counter()
+    results, _ = run_extractors(EXTRACTORS, text)
+    keywords = consolidate_keywords(keyword_phrases(results), scores=keyword_scores(results))
+    return {
+        "tier": tier,
+        "model": MODEL_TIERS[tier] or "blank:en",
+        "load_time": load_time,
+        "extract_time": time.perf_counter() - start,
+        "model_rss_mb": model_rss,
+        "peak_rss_mb": peak_rss_mb(),
+        "keywords": keywords,
+    }
+
+def compare_tiers(text: str, tiers=tuple(MODEL_TIERS), reference: list = None) -> list:
+    """Returns a report per model tier on text: its keywords, cost, and agreement with the reference keywords.
+
+    Each tier is measured in a fresh process so their memory does not add up.
+    The reference defaults to the lg tier's consolidated keywords. Tiers that
+    cannot be loaded are reported with their error.
+    """
+    reports = []
+    for tier in tiers:
+        try:
+            with ProcessPoolExecutor(1) as executor:
+                reports.append(executor.submit(measure_tier, tier, text).result())
+        except (ImportError, OSError) as e:
+            reports.append({"tier": tier, "model": MODEL_TIERS.get(tier), "error": str(e)})
+    if reference is None:
+        reference = next((report["keywords"] for report in reports if report["tier"] == "lg" and "keywords" in report), None)
+    for report in reports:
+        if reference is not None and "keywords" in report:
+            report.update(keyword_agreement(report["keywords"], reference))
+    return reports
+
+def split_text(text: str, max_chars: int) -> list:
+    """Splits text into pieces of at most max_chars, at sentence ends where possible, else at whitespace."""
+    pieces = []
+    while len(text) > max_chars:
+        ends = [match.end() for match in SENTENCE_END.finditer(text, 0, max_chars)]
+        cut = ends[-1] if ends else text.rfind(" ", 0, max_chars) + 1
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(text[:cut])
+        text = text[cut:]
+    pieces.append(text)
+    return pieces
+
+def iter_text_units(source, max_chars: int):
+    """Yields the paragraphs of a string or of an iterable of lines (such as an open file), one at a time.
+
+    Paragraphs longer than max_chars are split with split_text, so no more than
+    about max_chars of the source is buffered at once.
+    """
+    lines = io.StringIO(source) if isinstance(source, str) else source
+    buffer, size = [], 0
+    for line in lines:
+        if not line.strip():
+            if buffer:
+                yield "".join(buffer)
+                buffer, size = [], 0
+            continue
+        buffer.append(line)
+        size += len(line)
+        if size > max_chars:
+            *pieces, rest = split_text("".join(buffer), max_chars)
+            yield from pieces
+            buffer, size = [rest], len(rest)
+    if buffer:
+        yield "".join(buffer)
+
+def iter_windows(source, window_chars: int = WINDOW_CHARS, overlap_chars: int = WINDOW_OVERLAP_CHARS):
+    """Yields overlapping windows of at most window_chars over a string or an iterable of lines.
+
+    Windows end at paragraph boundaries, or at sentence ends inside long
+    paragraphs, and start with the last whole paragraphs of the previous
+    window that fit in overlap_chars.
+    """
+    window, size, fresh = deque(), 0, 0
+    for unit in iter_text_units(source, window_chars - overlap_chars):
+        if fresh and size + len(unit) + 1 > window_chars:
+            yield "\n".join(window)
+            carried, carried_size = deque(), 0
+            while window and carried_size + len(window[-1]) + 1 <= overlap_chars:
+                carried.appendleft(window.pop())
+                carried_size += len(carried[0]) + 1
+            window, size, fresh = carried, carried_size, 0
+        window.append(unit)
+        size += len(unit) + 1
+        fresh += 1
+    if fresh:
+        yield "\n".join(window)
+
+class KeywordMerger:
+    """Merges per-window extractor results into results for the whole text, one window at a time.
+
+    Phrases are matched across windows by their normalized form and keep the
+    first surface form seen. Scores combine the way each algorithm ranks:
+    YAKE scores fall as a keyword recurs (its term frequency is in the
+    denominator), so windows combine as 1 / sum(1 / score); a RAKE phrase score
+    does not grow with frequency, so the best window's score is kept; ranker
+    scores are averaged over the text, weighting each window by its length.
+    Only the best `max_phrases` phrases per extractor are kept, so memory stays
+    flat however many windows there are.
+    """
+
+    def __init__(self, extractors=EXTRACTORS, max_phrases=MAX_MERGED_PHRASES):
+        self.extractors = tuple(extractors)
+        self.max_phrases = max_phrases
+        self.total_chars = 0
+        self._phrases = {name: {} for name in self.extractors}  # Normalized phrase -> [surface form, merged value]
+
+    def add(self, results: dict, window_chars: int):
+        """Merges one window's results, as returned by run_extractors, into the totals."""
+        self.total_chars += window_chars
+        for name in self.extractors:
+            merged = self._phrases[name]
+            for keyword in results[name]:
+                phrase, score = (keyword[1], keyword[0]) if name == "rake" else keyword
+                if name == "yake":
+                    value = 1 / max(score, 1e-12)
+                elif name in RANKERS:
+                    value = score * window_chars
+                else:
+                    value = score
+                entry = merged.setdefault(normalize_phrase(phrase), [phrase, 0.0])
+                entry[1] = max(entry[1], value) if name == "rake" else entry[1] + value
+            if len(merged) > 2 * self.max_phrases:
+                best = sorted(merged.items(), key=lambda item: -item[1][1])[:self.max_phrases]
+                self._phrases[name] = dict(best)
+
+    def results(self) -> dict:
+        """Returns the merged results in each extractor's own format and order."""
+        results = {}
+        for name in self.extractors:
+            entries = sorted(self._phrases[name].values(), key=lambda entry: -entry[1])
+            if name == "yake":
+                results[name] = [(phrase, 1 / value) for phrase, value in entries]
+            elif name == "rake":
+                results[name] = [(value, phrase) for phrase, value in entries]
+            else:
+                results[name] = [(phrase, value / self.total_chars) for phrase, value in entries]
+        return results
+
+def extract_keywords_streaming(source, window_chars: int = WINDOW_CHARS, overlap_chars: int = WINDOW_OVERLAP_CHARS,
+                               extractors=EXTRACTORS, timings: dict = None) -> dict:
+    """Returns per-extractor results for a text of any size, given as a string or an iterable of lines.
+
+    The text is read and extracted one overlapping window at a time (see
+    iter_windows) and the results merged with KeywordMerger, so memory depends
+    on the window size rather than on the length of the text. If `timings` is
+    given, each extractor's seconds are added to it.
+    """
+    merger = KeywordMerger(extractors)
+    for window in iter_windows(source, window_chars, overlap_chars):
+        results, window_timings = run_extractors(extractors, window)
+        if timings is not None:
+            for name, seconds in window_timings.items():
+                timings[name] = timings.get(name, 0.0) + seconds
+        merger.add(results, len(window))
+    return merger.results()
+
+def read_documents(source: str, id_field: str = "id", text_field: str = "text"):
+    """Yields (id, text) pairs one at a time from a directory of text files, a JSONL file, or stdin ("-") as JSONL."""
+    if source == "-":
+        yield from _read_jsonl(sys.stdin, id_field, text_field)
+    elif os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                with open(path, encoding="utf-8", errors="replace") as f:
+                    yield os.path.relpath(path, source), f.read()
+    else:
+        with open(source, encoding="utf-8") as f:
+            yield from _read_jsonl(f, id_field, text_field)
+
+def _read_jsonl(lines, id_field, text_field):
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        yield record.get(id_field, line_number), record[text_field]
+
+def extract_corpus_keywords(documents, batch_size: int = 32, n_process: int = 1, timings: dict = None):
+    """Yields (id, per-extractor results) for a stream of (id, text) pairs, in order.
+
+    Documents are parsed in batches with nlp.pipe, optionally across
+    `n_process` processes, while YAKE and RAKE run on each parsed document
+    as it comes back. Only about batch_size * n_process documents are held
+    in memory at a time, however large the corpus. A document longer than
+    WINDOW_CHARS ends the current run of short ones: it is extracted window
+    by window on its own, then a new run starts after it. If `timings` is
+    given, each extractor's seconds are added to it, with the time spent
+    waiting on nlp.pipe counted as "parse".
+    """
+    nlp = get_nlp()
+    documents = iter(documents)
+    held = []  # The long document that ended the current run, if any
+
+    def run():
+        for doc_id, text in documents:
+            if len(text) > WINDOW_CHARS:
+                held.append((doc_id, text))
+                return
+            yield text, doc_id
+
+    while True:
+        parsed = nlp.pipe(run(), as_tuples=True, batch_size=batch_size, n_process=n_process,
+                          disable=RANKER_UNUSED_PIPES)
+        while True:
+            start = time.perf_counter()
+            try:
+                doc, doc_id = next(parsed)
+            except StopIteration:
+                break
+            parse_time = time.perf_counter() - start
+            results, doc_timings = run_extractors(EXTRACTORS, doc.text, doc)
+            if timings is not None:
+                doc_timings["parse"] = doc_timings.get("parse", 0.0) + parse_time
+                for name, seconds in doc_timings.items():
+                    timings[name] = timings.get(name, 0.0) + seconds
+            yield doc_id, results
+        if not held:
+            return
+        doc_id, text = held.pop()
+        yield doc_id, extract_keywords_streaming(text, timings=timings)
+
+def write_corpus_keywords(source: str, output, batch_size: int = 32, n_process: int = 1, pool=None, cache=None):
+    """Writes one JSON line of consolidated keywords per document in `source`, in order, as soon as it can.
+
+    With an ExtractorPool, each document's extractors run concurrently in the
+    pool instead. With a KeywordCache, only the documents whose keywords are
+    not cached are extracted, then cached; a cached document is written once
+    every document before it has been.
+    """
+    queue = deque()  # [id, hash, keywords] per document read and not yet written; keywords None until done
+    extracting = {}  # Sequence number -> queue entry, for the documents being extracted
+
+    def write_done():
+        written = False
+        while queue and queue[0][2] is not None:
+            doc_id, _, keywords = queue.popleft()
+            output.write(json.dumps({"id": doc_id, "keywords": keywords}) + "\n")
+            written = True
+        if written:
+            output.flush()
+
+    # Extractors see sequence numbers rather than ids, so duplicate ids can't be mixed up.
+    documents = _queued_documents(read_documents(source), cache, queue, extracting, write_done)
+    if pool is None:
+        extracted = extract_corpus_keywords(documents, batch_size, n_process)
+    else:
+        extracted = ((number, extraction["results"]) for number, extraction in pool.extract_documents(documents))
+    for number, results in extracted:
+        entry = extracting.pop(number)
+        entry[2] = consolidate_keywords(keyword_phrases(results), scores=keyword_scores(results))
+        if cache is not None:
+            for name in EXTRACTORS:
+                cache.put_json(cache.key("results", entry[1], extractor_config(name)), results[name])
+            cache.put_json(cache.key("consolidated", entry[1], consolidation_config()), entry[2])
+        write_done()
+    write_done()  # Cached documents after the last extracted one
+
+def _queued_documents(documents, cache, queue, extracting, write_done):
+    for number, (doc_id, text) in enumerate(documents):
+        document_hash = keywords = None
+        if cache is not None:
+            document_hash = cache.document_hash(text)
+            keywords = cache.get_json(cache.key("consolidated", document_hash, consolidation_config()))
+        entry = [doc_id, document_hash, keywords]
+        queue.append(entry)
+        if keywords is not None:
+            write_done()  # Straight away if nothing before it is still being extracted
+            continue
+        extracting[number] = entry
+        yield number, text
 
 text = """
 Socrates: And now allow me to draw a comparison in order to
@@ -331,78 +1195,79 @@ Glaukon: Yes. Such a craft must exist.
 """
 
 
-def main():
-    yake_keywords = extract_keywords_with_yake(text)
-    print('')
-    print('-----------------')
-    print('Yake Generated Keywords:')
-    print(yake_keywords)
-    
-
-    rake_keywords = extract_keywords_with_rake(text) # Rake returns keyword first
-    print('')
-    print('-----------------')
-    print('Rake Generated Keywords:')
-    print(rake_keywords)
-
-    pytextrank_keywords = extract_keywords_with_pytextrank(text)
-    print('')
-    print('-----------------')
-    print('PyTextRank Generated Keywords:')
-    print(pytextrank_keywords)
-
-    positionrank_keywords = extract_keywords_with_positionrank(text)
-    print('')
-    print('-----------------')
-    print('PositionRank Generated Keywords:')
-    print(positionrank_keywords)
-
-    topicrank_keywords = extract_keywords_with_topicrank(text)
-    print('')
-    print('-----------------')
-    print('TopicRank Generated Keywords:')
-    print(topicrank_keywords)
-
-
-    yake_keywords = [keyword[0] for keyword in yake_keywords]
-    rake_keywords = [keyword[1] for keyword in rake_keywords]
-    pytextrank_keywords = [keyword[0] for keyword in pytextrank_keywords]
-    positionrank_keywords = [keyword[0] for keyword in positionrank_keywords]
-    topicrank_keywords = [keyword[0] for keyword in topicrank_keywords]
-
-    all_keywords = [
-        yake_keywords, 
-        rake_keywords, 
-        pytextrank_keywords, 
-        positionrank_keywords, 
-        topicrank_keywords
-    ]
-
-    consolidated_keywords = []
-
-    # Iterating over each keyword from each keyword extractor
-    for keywords in all_keywords:
-        for keyword in keywords:
-            matches = 0
-
-            # Comparing with all other keywords
-            for other_keywords in all_keywords:
-                if other_keywords is not keywords: # We don't want to compare with itself
-                    for other_keyword in other_keywords:
-                        if fuzz.ratio(keyword, other_keyword) >= matching_ratio:
-                            matches += 1
-                            break # We found a match, no need to keep comparing with the rest
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract keywords from the built-in text, or from a corpus with --corpus.")
+    parser.add_argument("--corpus", help="Directory of text files, JSONL file with id and text fields, or - for JSONL on stdin")
+    parser.add_argument("--output", help="Write JSONL here instead of stdout")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--n-process", type=int, default=1, help="Processes for spaCy parsing")
+    parser.add_argument("--workers", type=int, default=0, help="Run the extractors concurrently in this many worker processes")
+    parser.add_argument("--share-parse", action=argparse.BooleanOptionalAction, default=True,
+                        help="With --workers, run the rank-based extractors as one task on one parse "
+                             "(the default; --no-share-parse gives each ranker its own task and parse)")
+    parser.add_argument("--model-tier", choices=MODEL_TIERS, default=MODEL_TIER, help="spaCy model for the rank-based extractors")
+    parser.add_argument("--compare-tiers", action="store_true", help="Report each model tier's cost and agreement with lg on the built-in text")
+    parser.add_argument("--reference", help="With --compare-tiers, a JSON list of keywords to compare against instead of lg's")
+    parser.add_argument("--cache", help="Directory to cache keywords and parses in, shared across runs and workers")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Cache size limit in MB")
+    parser.add_argument("--input", help="Extract from this text file, window by window, instead of the built-in text")
+    parser.add_argument("--window-chars", type=int, default=WINDOW_CHARS, help="With --input, characters per window")
+    args = parser.parse_args(argv)
+    instrumentation.configure_from_environment()
+    if args.compare_tiers:
+        reference = None
+        if args.reference:
+            with open(args.reference, encoding="utf-8") as f:
+                reference = json.load(f)
+        print(json.dumps(compare_tiers(text, reference=reference), indent=2))
+        return
+    set_model_tier(args.model_tier)
+    cache = KeywordCache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+    pool = ExtractorPool(args.workers, share_parse=args.share_parse) if args.workers else None
+    try:
+        if args.corpus:
+            if args.output:
+                with open(args.output, "w", encoding="utf-8") as output:
+                    write_corpus_keywords(args.corpus, output, args.batch_size, args.n_process, pool, cache)
+            else:
+                write_corpus_keywords(args.corpus, sys.stdout, args.batch_size, args.n_process, pool, cache)
+            return
 
-            if matches >= 3: # The keyword matches with at least two other keywords
-                consolidated_keywords.append(keyword)
+        consolidated_keywords = None
+        if args.input:
+            start = time.perf_counter()
+            with open(args.input, encoding="utf-8", errors="replace") as f:
+                results = extract_keywords_streaming(f, args.window_chars, min(WINDOW_OVERLAP_CHARS, args.window_chars // 4))
+            timings = {"total": time.perf_counter() - start}
+        elif cache is not None:
+            start = time.perf_counter()
+            results, consolidated_keywords = extract_keywords_cached(text, cache)
+            timings = {"total": time.perf_counter() - start, "cache_hits": cache.hits, "cache_misses": cache.misses}
+        elif pool is not None:
+            extraction = pool.extract(text)
+            results, timings = extraction["results"], extraction["timings"]
+        else:
+            results, timings = run_extractors(EXTRACTORS, text)  # The rank-based extractors share one parse
+    finally:
+        if pool is not None:
+            pool.close()
 
-    set(consolidated_keywords)# Use set to remove duplicates
+    for name in EXTRACTORS:
+        print('')
+        print('-----------------')
+        print(f'{EXTRACTOR_LABELS[name]} Generated Keywords:')
+        print(results[name])
 
-    consolidated_keywords = fuzzy_deduplicate(consolidated_keywords, match_threshold=95)
+    if consolidated_keywords is None:
+        consolidated_keywords = consolidate_keywords(keyword_phrases(results), scores=keyword_scores(results))
     print('')
     print('-----------------')
     print('Consolidated keywords after fuzzy deduplication: ')
     print(consolidated_keywords)
+    print('')
+    print('-----------------')
+    print('Extractor timings (seconds):')
+    print(json.dumps(timings, indent=2))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,155 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import uuid
+from collections import Counter
+
+import instrumentation
+from conversation import MODEL, num_tokens_from_message
+
+RECALL_HEADER = "Relevant messages from earlier in the conversation:"
+MAX_QUERY_TERMS = 32
+MAX_SCORED_POSTINGS = 500  # Messages ranked per search; bounds its cost however large the archive gets
+_WORD = re.compile(r"[^\W_]+")  # Words as FTS5's unicode61 tokenizer splits them
+
+class MessageArchive:
+    """Keeps the messages evicted from conversations in an on-disk full-text index and recalls the relevant ones.
+
+    Messages are added as they leave the context, so the index grows
+    incrementally, and are ranked against a query with BM25 over their
+    lowercased word tokens, using SQLite's FTS5 index. Each archive holds any
+    number of sessions in one file, partitioned by session: every word is
+    indexed under a key derived from the session id, and term counts are kept
+    per session, so a search only reads and ranks `session_id`'s postings
+    however many other sessions share the file.
+    `recall_message` packs the best matches into one system message that fits
+    a fixed token allowance, to send along with the next request.
+
+    Ranking costs time per matching message, so a search uses the query's
+    rarest terms first and leaves out common ones once MAX_SCORED_POSTINGS
+    messages would match; those are the terms BM25 weighs least. If even the
+    rarest term is that common, only its newest MAX_SCORED_POSTINGS matches
+    are ranked. A search stays in the low milliseconds with tens of thousands
+    of archived messages.
+    """
+
+    def __init__(self, path=":memory:", session_id=None, model=MODEL):
+        self.path = path
+        self.session_id = session_id or uuid.uuid4().hex
+        self.model = model
+        self._key = hashlib.sha1(self.session_id.encode("utf-8")).hexdigest()[:16]  # Prefixed to every indexed word
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS archive_messages (
+                id INTEGER PRIMARY KEY, session TEXT NOT NULL, role TEXT NOT NULL, name TEXT, content TEXT NOT NULL,
+                num_tokens INTEGER NOT NULL);
+            CREATE VIRTUAL TABLE IF NOT EXISTS archive_index USING fts5(
+                terms, content='', tokenize='unicode61 remove_diacritics 0');
+            CREATE TABLE IF NOT EXISTS archive_session_terms (
+                session TEXT NOT NULL, term TEXT NOT NULL, messages INTEGER NOT NULL,
+                PRIMARY KEY (session, term)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS archive_sessions (session TEXT PRIMARY KEY, messages INTEGER NOT NULL);
+        """)
+
+    def add(self, messages, counts=None):
+        """Archives messages, with their token counts if they are already known, and returns how many were added."""
+        messages = list(messages)
+        if counts is None:
+            counts = [num_tokens_from_message(message, self.model) for message in messages]
+        words = [_WORD.findall(message["content"].lower()) for message in messages]
+        terms = Counter(term for message_words in words for term in set(message_words))
+        with self._lock, self._db:
+            for message, num_tokens, message_words in zip(messages, counts, words):
+                rowid = self._db.execute(
+                    "INSERT INTO archive_messages (session, role, name, content, num_tokens) VALUES (?, ?, ?, ?, ?)",
+                    (self.session_id, message["role"], message.get("name"), message["content"], num_tokens)).lastrowid
+                self._db.execute("INSERT INTO archive_index (rowid, terms) VALUES (?, ?)",
+                                 (rowid, " ".join(self._key + word for word in message_words)))
+            self._db.executemany("INSERT INTO archive_session_terms VALUES (?, ?, ?) "
+                                 "ON CONFLICT (session, term) DO UPDATE SET messages = messages + excluded.messages",
+                                 [(self.session_id, term, count) for term, count in terms.items()])
+            self._db.execute("INSERT INTO archive_sessions VALUES (?, ?) "
+                             "ON CONFLICT (session) DO UPDATE SET messages = messages + excluded.messages",
+                             (self.session_id, len(messages)))
+        return len(messages)
+
+    def __len__(self):
+        with self._lock:
+            row = self._db.execute("SELECT messages FROM archive_sessions WHERE session = ?", (self.session_id,)).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _quote(term):
+        return '"' + term.replace('"', '""') + '"'
+
+    @instrumentation.timed("archive_search")
+    def search(self, query, limit=5):
+        """Returns up to `limit` archived messages of this session matching query, best first, as (message, num_tokens)."""
+        terms = list(dict.fromkeys(_WORD.findall(query.lower())))[:MAX_QUERY_TERMS]
+        if not terms:
+            return []
+        with self._lock:
+            frequencies = self._db.execute(
+                f"SELECT messages, term FROM archive_session_terms "
+                f"WHERE session = ? AND term IN ({', '.join('?' * len(terms))}) ORDER BY messages",
+                (self.session_id, *terms)).fetchall()
+            terms, postings = [], 0
+            for frequency, term in frequencies:
+                if terms and postings + frequency > MAX_SCORED_POSTINGS:
+                    break
+                terms.append(term)
+                postings += frequency
+            if not terms:
+                return []
+            rows = self._db.execute(
+                "SELECT content, role, name, num_tokens FROM ("
+                "  SELECT rowid, bm25(archive_index) AS score FROM archive_index"
+                "  WHERE archive_index MATCH ? ORDER BY rowid DESC LIMIT ?"
+                ") AS matches JOIN archive_messages ON archive_messages.id = matches.rowid ORDER BY score LIMIT ?",
+                (" OR ".join(self._quote(self._key + term) for term in terms), MAX_SCORED_POSTINGS, limit)).fetchall()
+        results = []
+        for content, role, name, num_tokens in rows:
+            message = {"role": role, "content": content}
+            if name is not None:
+                message["name"] = name
+            results.append((message, num_tokens))
+        return results
+
+    def recall_message(self, query, max_tokens, k=5):
+        """Returns a system message quoting up to k archived messages relevant to query in at most max_tokens, or None.
+
+        Matches too long for what is left of the allowance are skipped in favour of shorter ones further down.
+        """
+        header_tokens = num_tokens_from_message({"role": "system", "content": RECALL_HEADER}, self.model)
+        lines, used = [], header_tokens
+        for message, num_tokens in self.search(query, 4 * k):
+            if len(lines) == k:
+                break
+            if used + num_tokens > max_tokens:  # About what its quoted line costs
+                continue
+            lines.append(f"{message['role']}: {message['content']}")
+            used += num_tokens
+        while lines:
+            recalled = {"role": "system", "content": "\n".join([RECALL_HEADER, *lines])}
+            if num_tokens_from_message(recalled, self.model) <= max_tokens:
+                return recalled
+            lines.pop()
+        return None
+
+    def with_recall(self, messages, max_tokens, k=5):
+        """Returns messages with relevant archived ones quoted just before the last message, the request."""
+        messages = list(messages)
+        if not messages or max_tokens <= 0:
+            return messages
+        recalled = self.recall_message(messages[-1]["content"], max_tokens, k)
+        if recalled is not None:
+            messages.insert(len(messages) - 1, recalled)
+        return messages
+
+    def close(self):
+        """Closes the archive file."""
+        self._db.close()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""A local stand-in for the OpenAI ChatCompletion endpoint.
+
+Point openai.api_base at it to exercise the examples without an API key:
+
+    python mock_server.py --port 8000 --latency 0.2 --token-rate 50 --error-rate 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ERROR_TYPES = {
+    429: "rate_limit_error",
+    500: "server_error",
+    502: "server_error",
+    503: "server_error",
+}
+
+class MockChatCompletionServer:
+    """Serves /v1/chat/completions on a background thread, streaming or not.
+
+    Replies are `reply_words` words long, prefixed with the last user message so
+    runs are reproducible. `latency` is the delay before the first byte,
+    `chunk_size` the number of words per streamed chunk and `token_rate` the
+    words sent per second (0 for as fast as possible). A fraction `error_rate`
+    of requests fail with `error_status`, and a fraction `disconnect_rate` of
+    streams are cut off halfway through.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, chunk_size=1, token_rate=0, reply_words=60,
+                 error_rate=0.0, error_status=429, disconnect_rate=0.0, seed=None):
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.token_rate = token_rate
+        self.reply_words = reply_words
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.disconnect_rate = disconnect_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.disconnects = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_base(self):
+        """Returns the value to set openai.api_base to."""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """Starts serving on a daemon thread and returns the server."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        """Serves on the current thread until interrupted."""
+        self._httpd.serve_forever()
+
+    def reply(self, messages):
+        """Returns the words of the reply to a list of messages."""
+        prompt = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        words = ["Mock", "reply", "to:"] + prompt.split()[:10]
+        filler = ["lorem", "ipsum", "dolor", "sit", "amet"]
+        while len(words) < self.reply_words:
+            words.append(filler[len(words) % len(filler)])
+        return words[:self.reply_words]
+
+    def _roll(self, rate):
+        with self._lock:
+            return rate > 0 and self.random.random() < rate
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+                    return
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                request = json.loads(body or b"{}")
+                server._count("requests")
+                if server.latency:
+                    time.sleep(server.latency)
+                if server._roll(server.error_rate):
+                    server._count("errors")
+                    status = server.error_status
+                    error = {"message": "Injected error from the mock server", "type": ERROR_TYPES.get(status, "server_error")}
+                    self._send_json(status, {"error": error}, {"Retry-After": "0"} if status == 429 else None)
+                    return
+                words = server.reply(request.get("messages", []))
+                try:
+                    if request.get("stream"):
+                        self._stream(request, words)
+                    else:
+                        self._complete(request, words)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client went away; nothing left to send.
+                    self.close_connection = True
+
+            def _send_json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _complete(self, request, words):
+                if server.token_rate:
+                    time.sleep(len(words) / server.token_rate)
+                content = " ".join(words)
+                prompt_tokens = sum(len(m.get("content", "").split()) for m in request.get("messages", []))
+                self._send_json(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)},
+                })
+
+            def _stream(self, request, words):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+                def event(delta, finish_reason=None):
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": request.get("model"),
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                    }
+                    self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+
+                disconnect_at = len(words) // 2 if server._roll(server.disconnect_rate) else None
+                event({"role": "assistant"})
+                for start in range(0, len(words), server.chunk_size):
+                    if disconnect_at is not None and start >= disconnect_at:
+                        # Drop the connection without finishing the chunked body.
+                        server._count("disconnects")
+                        self.close_connection = True
+                        self.wfile.flush()
+                        return
+                    piece = words[start:start + server.chunk_size]
+                    if server.token_rate:
+                        time.sleep(len(piece) / server.token_rate)
+                    event({"content": (" " if start else "") + " ".join(piece)})
+                event({}, "stop")
+                self._write_chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _write_chunk(self, text):
+                data = text.encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock OpenAI ChatCompletion endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the first byte of each response")
+    parser.add_argument("--chunk-size", type=int, default=1, help="Words per streamed chunk")
+    parser.add_argument("--token-rate", type=float, default=0, help="Words sent per second, 0 for unlimited")
+    parser.add_argument("--reply-words", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="Fraction of streams cut off halfway")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    server = MockChatCompletionServer(args.host, args.port, args.latency, args.chunk_size, args.token_rate,
+                                      args.reply_words, args.error_rate, args.error_status, args.disconnect_rate, args.seed)
+    print(f"Serving mock ChatCompletion API at {server.api_base}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
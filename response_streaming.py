@@ -1,103 +1,99 @@
 #!/usr/bin/env python3
-import subprocess
-import sys
-import time
+import asyncio
+import json
 
-def install(package):
-    subprocess.check_call([sys.executable, "-m", "pip", "install", package])
+import openai
+from termcolor import colored
 
-try:
-    import openai
-except ImportError:
-    print("Installing module: openai")
-    install('openai')
-    import openai
+import instrumentation
+from chat_context import TRUNCATION_NOTICES, ChatContext
+from completion_cache import CompletionCache
+from conversation import MODEL, StreamingTokenCounter
+from message_archive import MessageArchive
+from session_log import SessionLog
+from streaming import StreamMetrics, StreamingClient, TerminalRenderer
+from summarizer import SummaryCache
 
-try:
-    import tiktoken
-except ImportError:
-    print("Installing module: tiktoken")
-    install('tiktoken')
-    import tiktoken
-
-try:
-    from termcolor import colored
-except ImportError:
-    print("Installing module: termcolor")
-    install('termcolor')
-    from termcolor import colored
+instrumentation.configure_from_environment()  # LLM_METRICS / LLM_PROFILE, see instrumentation.py
 
 print("")
 openai.api_key = input("Please enter your OpenAI API key: ")
 MAX_TOKENS = 512
+RESPONSE_TOKENS = 128  # Reserved out of MAX_TOKENS for the reply
+RECALL_TOKENS = 64  # Reserved out of MAX_TOKENS for earlier messages recalled from the archive
+ARCHIVE_PATH = "message_archive.db"  # Where removed messages are kept to be recalled
+COMPLETION_CACHE_DIR = ".completion_cache"  # Where responses are kept to answer repeated requests
+SESSION_LOG_PATH = "sessions.db"  # Where conversations are kept to be resumed
+TRUNCATION = "summarize"  # Or "remove" for oldest first, or "relevance" to keep what the request is about
+
+streaming_client = StreamingClient(max_retries=3, max_tokens=RESPONSE_TOKENS)
+completion_cache = CompletionCache(directory=COMPLETION_CACHE_DIR)
+
+@instrumentation.timed("completion", kind="stream")
+def openai_chat_completion(messages):
+    """Streams the response to the console, replaying the cached one if the same request was answered before.
+
+    Returns the full response content, its token count as a message and the metrics of the turn.
+    """
+    return asyncio.run(stream_chat_completion(messages))
+
+async def stream_chat_completion(messages):
+    renderer = TerminalRenderer(color='green')  # Prints chunks to the console in frames as they come in
+    token_counter = StreamingTokenCounter()
+    metrics = StreamMetrics()
+    chunks = completion_cache.stream(streaming_client.stream, messages, model=streaming_client.model,
+                                     **streaming_client.params)
+    async for chunk_content in renderer.paced(chunks):  # Shows what has come in if the stream stalls
+        metrics.record_chunk()
+        token_counter.add(chunk_content)
+        renderer.write(chunk_content)
+    response_content = renderer.close()  # Return the full response content at the end
+    return response_content, token_counter.message_tokens("assistant"), metrics.finish(token_counter.total)
 
-def num_tokens_from_messages(messages):
-    """Returns the number of tokens used by a list of messages."""
-    model = "gpt-3.5-turbo"
-    encoding = tiktoken.encoding_for_model(model)
-    num_tokens = 0
-    for message in messages:
-        num_tokens += len(encoding.encode(message["content"]))
-    return num_tokens
+@instrumentation.timed("completion", kind="summary")
+def openai_summary_completion(messages):
+    """Returns the response from the OpenAI API without streaming it to the console, or the cached one to the same request."""
+    return completion_cache.complete(request_summary_completion, messages, model=MODEL, max_tokens=RESPONSE_TOKENS)
 
-def openai_chat_completion(messages, max_retries=3):
-    retries = 0
-    backoff_time = 1
-    full_response_content = ""
-    while retries <= max_retries:
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                stream=True
-            )
-            for chunk in response:
-                if 'choices' in chunk and len(chunk.choices) > 0:
-                    if 'delta' in chunk.choices[0] and 'content' in chunk.choices[0]['delta']:
-                        chunk_content = chunk.choices[0]['delta']['content']
-                        print(colored(chunk_content, 'green'), end='', flush=True)  # Print each chunk to console as it comes in
-                        full_response_content += chunk_content  # Store each chunk in a string
-            return full_response_content  # Return the full response content at the end
-        except openai.error as e:
-            raise e
+def request_summary_completion(messages):
+    response = openai.ChatCompletion.create(
+        model=MODEL,
+        messages=messages,
+        max_tokens=RESPONSE_TOKENS,
+    )
+    return response.choices[0].message['content']
 
-def truncate_by_removing(conversation_history):
-    """Removes the oldest messages until the conversation history is short enough."""
-    print(colored("Removing oldest messages.", 'red'))
-    while num_tokens_from_messages(conversation_history) > MAX_TOKENS:
-        conversation_history.pop(0)
-    return conversation_history
+def print_truncation(truncation):
+    print(colored(TRUNCATION_NOTICES[truncation], 'red'))
 
-def truncate_by_summarizing(conversation_history):
-    """Summarizes the oldest messages until the conversation history is short enough."""
-    print(colored("Removing oldest messages.", 'red'))
-    messages_to_remove = []
-    while num_tokens_from_messages(conversation_history) > MAX_TOKENS:
-        messages_to_remove.append(conversation_history.pop(0))
-    if messages_to_remove:
-        messages_to_remove.append({"role": "system", "content": "You are responsible for summarizing the previous conversation."})
-        summary = openai_chat_completion(messages_to_remove)
-        print(colored(f"\nSummary of removed messages: \n{summary}", 'yellow'))
-        conversation_history.insert(0, {"role": "assistant", "content": f'Summary of Removed Messages: {summary}'})
-    return conversation_history
+def print_summary(summary):
+    print(colored(f"\nSummary of removed messages: \n{summary}", 'yellow'))
 
-conversation_history = []
+session_log = SessionLog(SESSION_LOG_PATH, input("Session to resume (press Enter to start a new one): ") or None)
+context = ChatContext(SummaryCache(openai_summary_completion), MessageArchive(ARCHIVE_PATH, session_log.session_id),
+                      session_log.load(), TRUNCATION, MAX_TOKENS, RESPONSE_TOKENS, RECALL_TOKENS,
+                      on_truncate=print_truncation, on_summary=print_summary)
+conversation_history = context.history
+print(colored(f"Session {session_log.session_id}: {len(conversation_history)} messages resumed", 'cyan'))
 while True:
-    if num_tokens_from_messages(conversation_history) > MAX_TOKENS:
-        conversation_history = truncate_by_summarizing(conversation_history)
-    
     user_input = input("\nPlease enter your request (type 'q' or 'quit' to exit): ")
     if user_input.lower() in ['q', 'quit']:
+        print(colored(f"\nCompletion cache: {json.dumps(completion_cache.stats())}", 'cyan'))
         break
 
-    new_message = {"role": "user", "content": user_input}
-    conversation_history.append(new_message)
+    request = context.prepare(user_input)  # With relevant removed messages, if any
 
-    print(colored(f"\n{num_tokens_from_messages(conversation_history)} tokens", 'green'))
-    print(colored("\nFull conversation history:", 'blue'))
-    for message in conversation_history:
-        print(message)
-    print("")
-    response_content = openai_chat_completion(conversation_history)
-    conversation_history.append({"role": "assistant", "content": response_content})
-    print(f"\n")
\ No newline at end of file
+    with instrumentation.timer("console_output"):
+        print(colored(f"\n{conversation_history.total_tokens} tokens", 'green'))
+        print(colored("\nFull conversation history:", 'blue'))
+        for message in conversation_history:
+            print(message)
+        print("")
+    session_log.sync(conversation_history)  # Keep the request if the process dies waiting for the reply
+    response_content, response_tokens, response_metrics = openai_chat_completion(request)
+    context.add_reply(response_content, response_tokens)  # And compact the oldest messages while the user is typing
+    if response_metrics["time_to_first_token"] is not None:  # Wall time is recorded by openai_chat_completion
+        instrumentation.observe("time_to_first_token", response_metrics["time_to_first_token"], kind="stream")
+    session_log.sync(conversation_history)
+    print(colored(f"\n\n{json.dumps(response_metrics)}", 'cyan'))
+    print("")
\ No newline at end of file
@@ -0,0 +1,142 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+from conversation import MODEL, ConversationLedger
+from summarizer import SUMMARY_PREFIX
+
+class SessionLog:
+    """Keeps conversations in an append-only SQLite log so they survive restarts and can move between machines.
+
+    Every message that enters a session's history is appended once, with its
+    token count, as a "message" entry, or a "summary" entry if it is a summary
+    that truncation inserted. Alongside the log each session stores its current
+    context window as the list of entries it is made of, so `load` reads that
+    one row and the window's own entries, however long the conversation has
+    been, and rebuilds the ledger from the stored counts without encoding
+    anything. Every `compact_every` appends, the entries that have left the
+    window are compacted: rewritten together into one zlib-compressed segment
+    and taken out of the live table, which stays about the size of the
+    windows. Nothing is dropped; `entries` reads the whole log back, segments
+    included, so copying the file moves the sessions with their full history.
+    """
+
+    def __init__(self, path="sessions.db", session_id=None, model=MODEL, compact_every=1000):
+        self.path = path
+        self.session_id = session_id or uuid.uuid4().hex
+        self.model = model
+        self.compact_every = compact_every
+        self._window = []  # (message, entry seq) for each message of the history last synced
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS log_entries (
+                session TEXT NOT NULL, seq INTEGER NOT NULL, kind TEXT NOT NULL, role TEXT NOT NULL, name TEXT,
+                content TEXT NOT NULL, num_tokens INTEGER NOT NULL, created REAL NOT NULL,
+                PRIMARY KEY (session, seq)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS log_segments (
+                session TEXT NOT NULL, first_seq INTEGER NOT NULL, last_seq INTEGER NOT NULL, entries INTEGER NOT NULL,
+                data BLOB NOT NULL, PRIMARY KEY (session, first_seq)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS log_sessions (
+                session TEXT PRIMARY KEY, window TEXT NOT NULL, next_seq INTEGER NOT NULL,
+                appended INTEGER NOT NULL, updated REAL NOT NULL);
+        """)
+        self._db.execute("INSERT OR IGNORE INTO log_sessions VALUES (?, '[]', 0, 0, ?)", (self.session_id, time.time()))
+        self._db.commit()
+
+    def sessions(self):
+        """Returns the ids of the sessions in the log, most recently updated first."""
+        with self._lock:
+            rows = self._db.execute("SELECT session FROM log_sessions ORDER BY updated DESC").fetchall()
+        return [session for session, in rows]
+
+    def load(self, ledger=None):
+        """Fills a ledger (a new ConversationLedger by default) with the session's current window and returns it."""
+        if ledger is None:
+            ledger = ConversationLedger(model=self.model)
+        with self._lock:
+            window, = self._db.execute("SELECT window FROM log_sessions WHERE session = ?", (self.session_id,)).fetchone()
+            seqs = json.loads(window)
+            rows = self._db.execute(
+                f"SELECT seq, role, name, content, num_tokens FROM log_entries "
+                f"WHERE session = ? AND seq IN ({', '.join('?' * len(seqs))})",
+                (self.session_id, *seqs)).fetchall() if seqs else []
+        entries = {seq: (role, name, content, num_tokens) for seq, role, name, content, num_tokens in rows}
+        self._window = []
+        for seq in seqs:
+            role, name, content, num_tokens = entries[seq]
+            message = {"role": role, "content": content}
+            if name is not None:
+                message["name"] = name
+            ledger.append(message, num_tokens)
+            self._window.append((ledger[-1], seq))
+        return ledger
+
+    def sync(self, ledger):
+        """Appends the ledger's new messages to the log and records its messages as the current window.
+
+        Messages are told apart by identity, so whatever a truncation did to the
+        ledger since the last sync (or load), only what it added is appended.
+        Returns how many entries were appended.
+        """
+        known = {id(message): seq for message, seq in self._window}
+        now = time.time()
+        with self._lock, self._db:
+            next_seq, appended = self._db.execute("SELECT next_seq, appended FROM log_sessions WHERE session = ?",
+                                                  (self.session_id,)).fetchone()
+            window, rows = [], []
+            for i, message in enumerate(ledger):
+                seq = known.get(id(message))
+                if seq is None:
+                    seq = next_seq
+                    next_seq += 1
+                    content = message["content"]
+                    kind = "summary" if message["role"] == "assistant" and content.startswith(SUMMARY_PREFIX) else "message"
+                    rows.append((self.session_id, seq, kind, message["role"], message.get("name"), content,
+                                 ledger.tokens_at(i), now))
+                window.append((message, seq))
+            self._db.executemany("INSERT INTO log_entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            appended += len(rows)
+            self._db.execute("UPDATE log_sessions SET window = ?, next_seq = ?, appended = ?, updated = ? WHERE session = ?",
+                             (json.dumps([seq for _, seq in window]), next_seq, appended, now, self.session_id))
+        self._window = window
+        if appended >= self.compact_every:
+            self.compact()
+        return len(rows)
+
+    def compact(self):
+        """Moves the session's entries that have left its window into a new segment and returns how many were moved."""
+        with self._lock, self._db:
+            window, = self._db.execute("SELECT window FROM log_sessions WHERE session = ?", (self.session_id,)).fetchone()
+            seqs = json.loads(window)
+            condition = f"session = ? AND seq NOT IN ({', '.join('?' * len(seqs))})"
+            rows = self._db.execute(f"SELECT seq, kind, role, name, content, num_tokens, created FROM log_entries "
+                                    f"WHERE {condition} ORDER BY seq", (self.session_id, *seqs)).fetchall()
+            if rows:
+                data = zlib.compress(json.dumps(rows, ensure_ascii=False).encode("utf-8"))
+                self._db.execute("INSERT INTO log_segments VALUES (?, ?, ?, ?, ?)",
+                                 (self.session_id, rows[0][0], rows[-1][0], len(rows), data))
+                self._db.execute(f"DELETE FROM log_entries WHERE {condition}", (self.session_id, *seqs))
+            self._db.execute("UPDATE log_sessions SET appended = 0 WHERE session = ?", (self.session_id,))
+        return len(rows)
+
+    def entries(self):
+        """Returns every entry the session has logged, compacted or not, oldest first, as dicts."""
+        with self._lock:
+            segments = self._db.execute("SELECT data FROM log_segments WHERE session = ?", (self.session_id,)).fetchall()
+            live = self._db.execute("SELECT seq, kind, role, name, content, num_tokens, created FROM log_entries "
+                                    "WHERE session = ?", (self.session_id,)).fetchall()
+        rows = [row for data, in segments for row in json.loads(zlib.decompress(data))]
+        rows.extend(live)
+        rows.sort(key=lambda row: row[0])
+        keys = ("seq", "kind", "role", "name", "content", "num_tokens", "created")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def close(self):
+        """Closes the log file."""
+        self._db.close()
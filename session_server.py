@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""Hosts many independent conversations in one process behind a small HTTP API.
+
+    OPENAI_API_KEY=... python session_server.py --port 8080 --max-concurrency 64
+
+    POST   /sessions                  {"policy": "summarize", "max_tokens": 512}  -> {"session_id": ...}
+    GET    /sessions/{id}                                                        -> the session's history
+    POST   /sessions/{id}/messages    {"content": "...", "stream": false}        -> the reply
+    DELETE /sessions/{id}
+    GET    /metrics                                                              -> Prometheus text, with --metrics
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+import aiohttp
+import openai
+from aiohttp import web
+
+import instrumentation
+from chat_context import TRUNCATIONS, ChatContext
+from conversation import StreamingTokenCounter, TokenLedger
+from streaming import StreamMetrics, StreamingClient
+from summarizer import SummaryCache
+
+POLICIES = TRUNCATIONS  # trim cuts the oldest tokens, even partway into a message
+
+class ChatSession:
+    """One conversation: its history, token budget and truncation policy, applied by a ChatContext."""
+
+    def __init__(self, session_id, max_tokens, response_tokens, policy, summary_cache):
+        self.session_id = session_id
+        self.max_tokens = max_tokens
+        self.response_tokens = response_tokens
+        self.policy = policy
+        self.summaries = []  # Summaries put in the history during the current turn
+        # Token ids rather than strings, to keep per-session memory down; no archive, so no recall.
+        self.context = ChatContext(summary_cache, None, TokenLedger(), policy, max_tokens, response_tokens,
+                                   recall_tokens=0, on_summary=self.summaries.append)
+        self.lock = asyncio.Lock()  # One turn at a time per conversation
+        self.last_active = time.monotonic()
+
+    @property
+    def history(self):
+        return self.context.history
+
+    def describe(self):
+        """Returns the session as a JSON-serializable dict."""
+        return {
+            "session_id": self.session_id,
+            "policy": self.policy,
+            "max_tokens": self.max_tokens,
+            "response_tokens": self.response_tokens,
+            "total_tokens": self.history.total_tokens,
+            "messages": self.history.messages,
+        }
+
+class SessionService:
+    """Runs turns for many conversations on one event loop.
+
+    Every session shares one StreamingClient, so `max_concurrency` on that
+    client bounds the upstream calls across all of them, and one SummaryCache,
+    so summaries of identical spans are shared too. At most `max_sessions`
+    sessions are kept; the least recently used one is dropped beyond that.
+    """
+
+    def __init__(self, client, max_tokens=512, response_tokens=128, policy="remove", max_sessions=10000):
+        self.client = client
+        self.max_tokens = max_tokens
+        self.response_tokens = response_tokens
+        self.policy = policy
+        self.max_sessions = max_sessions
+        self.summary_cache = SummaryCache(self._complete_from_thread)
+        self._sessions = OrderedDict()
+        self._loop = None
+        self._http = None
+
+    def create_session(self, max_tokens=None, response_tokens=None, policy=None):
+        """Creates a session and returns it."""
+        policy = policy or self.policy
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown truncation policy {policy!r}, expected one of {', '.join(POLICIES)}")
+        session = ChatSession(uuid.uuid4().hex, max_tokens or self.max_tokens, response_tokens or self.response_tokens,
+                              policy, self.summary_cache)
+        self._sessions[session.session_id] = session
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return session
+
+    def get_session(self, session_id):
+        """Returns a session, raising KeyError if there is no such session."""
+        session = self._sessions[session_id]
+        self._sessions.move_to_end(session_id)
+        session.last_active = time.monotonic()
+        return session
+
+    def close_session(self, session_id):
+        """Removes a session, raising KeyError if there is no such session."""
+        del self._sessions[session_id]
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _complete_from_thread(self, messages):
+        # SummaryCache is synchronous and runs in a worker thread; send its
+        # completions back through the shared client on the event loop.
+        future = asyncio.run_coroutine_threadsafe(self.client.complete(messages), self._loop)
+        return future.result()
+
+    async def close(self):
+        """Closes the HTTP connection pool shared by upstream requests."""
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
+    async def summarize(self, messages):
+        """Returns a summary of `messages`, made through the shared client."""
+        self._loop = asyncio.get_running_loop()
+        return await asyncio.to_thread(self.summary_cache.summarize, messages)
+
+    async def chat(self, session_id, content, on_delta=None):
+        """Runs one turn of a session and returns its record.
+
+        `on_delta`, if given, is awaited with each piece of the reply as it streams in.
+        """
+        session = self.get_session(session_id)
+        if self._http is None:
+            self._http = aiohttp.ClientSession()
+        openai.aiosession.set(self._http)  # Reuse upstream connections instead of one pool per request
+        self._loop = asyncio.get_running_loop()  # Summaries made on worker threads complete through it
+        async with session.lock:
+            context = session.context
+            session.summaries.clear()
+            try:
+                if session.policy == "summarize":
+                    # Summarizing blocks on the upstream call, so it runs off the event loop.
+                    request = await asyncio.to_thread(context.prepare, content)
+                else:
+                    request = context.prepare(content)
+
+                token_counter = StreamingTokenCounter(context.history.model)
+                metrics = StreamMetrics()
+                parts = []
+                async for chunk_content in self.client.stream(request):
+                    metrics.record_chunk()
+                    token_counter.add(chunk_content)
+                    parts.append(chunk_content)
+                    if on_delta is not None:
+                        await on_delta(chunk_content)
+            except BaseException:
+                # Put the history back as it was, so the next turn does not send two user messages
+                # in a row or lose what truncation removed to make room for this one.
+                context.discard_user_message()
+                raise
+            response_content = "".join(parts)
+            context.add_reply(response_content, tokens=token_counter.tokens)
+            turn_metrics = metrics.finish(token_counter.total)
+            instrumentation.observe("completion", turn_metrics["wall_time"], kind="stream")
+            return {
+                "session_id": session_id,
+                "response": response_content,
+                "summary": session.summaries[-1] if session.summaries else None,
+                "total_tokens": context.history.total_tokens,
+                "metrics": turn_metrics,
+            }
+
+def json_error(status, message):
+    return web.json_response({"error": message}, status=status)
+
+def upstream_error(error):
+    """Returns (status, message) for a failed upstream request: 504 if it timed out, 502 otherwise."""
+    if isinstance(error, (asyncio.TimeoutError, openai.error.Timeout)):
+        return 504, "Upstream request timed out"
+    return 502, f"Upstream request failed: {type(error).__name__}: {error}"
+
+UPSTREAM_ERRORS = (openai.error.OpenAIError, asyncio.TimeoutError, aiohttp.ClientError)
+
+def create_app(service):
+    """Returns the aiohttp application serving `service`."""
+    routes = web.RouteTableDef()
+
+    async def read_json(request):
+        if not request.can_read_body:
+            return {}
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text=json.dumps({"error": "Expected a JSON object"}), content_type="application/json")
+        return body
+
+    @routes.post("/sessions")
+    async def create_session(request):
+        body = await read_json(request)
+        try:
+            session = service.create_session(body.get("max_tokens"), body.get("response_tokens"), body.get("policy"))
+        except ValueError as e:
+            return json_error(400, str(e))
+        return web.json_response(session.describe(), status=201)
+
+    @routes.get("/sessions/{session_id}")
+    async def get_session(request):
+        try:
+            session = service.get_session(request.match_info["session_id"])
+        except KeyError:
+            return json_error(404, "No such session")
+        return web.json_response(session.describe())
+
+    @routes.delete("/sessions/{session_id}")
+    async def close_session(request):
+        try:
+            service.close_session(request.match_info["session_id"])
+        except KeyError:
+            return json_error(404, "No such session")
+        return web.Response(status=204)
+
+    @routes.post("/sessions/{session_id}/messages")
+    async def post_message(request):
+        session_id = request.match_info["session_id"]
+        body = await read_json(request)
+        if not isinstance(body.get("content"), str):
+            return json_error(400, "Expected a JSON body with a string 'content'")
+        try:
+            service.get_session(session_id)
+        except KeyError:
+            return json_error(404, "No such session")
+        if not body.get("stream"):
+            try:
+                record = await service.chat(session_id, body["content"])
+            except UPSTREAM_ERRORS as e:
+                return json_error(*upstream_error(e))
+            return web.json_response(record)
+
+        # Stream the reply as plain text, then a final line with the turn's record.
+        response = web.StreamResponse(headers={"Content-Type": "text/plain; charset=utf-8"})
+        await response.prepare(request)
+
+        async def write(chunk_content):
+            await response.write(chunk_content.encode("utf-8"))
+
+        try:
+            record = await service.chat(session_id, body["content"], on_delta=write)
+        except UPSTREAM_ERRORS as e:
+            # The 200 status has been sent already, so the error goes in the final line instead.
+            status, message = upstream_error(e)
+            record = {"session_id": session_id, "status": status, "error": message}
+        else:
+            del record["response"]
+        await response.write(f"\n{json.dumps(record)}\n".encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    @routes.get("/metrics")
+    async def get_metrics(request):
+        return web.Response(text=instrumentation.registry.prometheus(), content_type="text/plain")
+
+    async def close_service(app):
+        await service.close()
+
+    app = web.Application()
+    app.add_routes(routes)
+    app.on_cleanup.append(close_service)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve many chat sessions from one process.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-concurrency", type=int, default=64, help="Upstream streams open at once across all sessions")
+    parser.add_argument("--max-sessions", type=int, default=10000)
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--response-tokens", type=int, default=128)
+    parser.add_argument("--policy", choices=POLICIES, default="remove", help="Default truncation policy for new sessions")
+    parser.add_argument("--api-base", help="Send requests to this endpoint, e.g. mock_server.py")
+    parser.add_argument("--metrics", action="store_true", help="Record timings and counters, served at GET /metrics")
+    args = parser.parse_args()
+
+    openai.api_key = os.environ.get("OPENAI_API_KEY", "mock" if args.api_base else None)
+    if args.metrics:
+        instrumentation.registry.enable()
+    if args.api_base:
+        openai.api_base = args.api_base
+    client = StreamingClient(max_concurrency=args.max_concurrency, max_tokens=args.response_tokens)
+    service = SessionService(client, args.max_tokens, args.response_tokens, args.policy, args.max_sessions)
+    web.run_app(create_app(service), host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+import asyncio
+import random
+import sys
+import time
+
+import aiohttp
+import openai
+from termcolor import colored
+
+import instrumentation
+from conversation import MODEL
+
+RESUME_PROMPT = "Continue your previous message exactly where it stopped, without repeating any of it."
+
+def delta_content(chunk):
+    """Returns the content delta carried by a streamed chunk, or an empty string."""
+    choices = chunk.get("choices")
+    if not choices:
+        return ""
+    return choices[0].get("delta", {}).get("content") or ""
+
+def is_retryable(error):
+    """Returns whether an error is transient: a rate limit, a 5xx, a timeout or a dropped connection."""
+    if isinstance(error, (openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.TryAgain,
+                          openai.error.Timeout, openai.error.APIConnectionError)):
+        return True
+    if isinstance(error, openai.error.APIError):
+        # Errors sent as events partway through a stream arrive with the stream's 200 status.
+        return error.http_status is None or error.http_status >= 500 or error.http_status < 400
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError, ConnectionError))
+
+def retry_after(error):
+    """Returns the delay the server asked for in a Retry-After header, if any."""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, base=1, cap=30):
+    """Returns an exponential backoff delay with full jitter for the given attempt."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class StreamingClient:
+    """Streams chat completions on an asyncio event loop.
+
+    Transient failures (429s, 5xx errors, timeouts and dropped connections) are
+    retried up to `max_retries` times with jittered exponential backoff, or
+    after the server's Retry-After delay, both capped at `max_backoff`. If a
+    stream breaks partway, the content received so far is kept and the retry
+    asks the model to continue from it, so callers see one uninterrupted
+    stream. Any number of streams can run concurrently on the same loop; set
+    `max_concurrency` to cap how many are open upstream at once when the client
+    is shared. `create` defaults to `openai.ChatCompletion.acreate`; extra
+    keyword arguments such as `max_tokens` are passed on with every request.
+    """
+
+    def __init__(self, model=MODEL, max_retries=3, backoff=1, max_backoff=30,
+                 connect_timeout=30, chunk_timeout=30, create=None, max_concurrency=None, **params):
+        self.model = model
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.connect_timeout = connect_timeout
+        self.chunk_timeout = chunk_timeout
+        self.create = create or openai.ChatCompletion.acreate
+        self.params = params
+        self._slots = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+
+    async def stream(self, messages):
+        """Yields the content deltas of the response to `messages` as they arrive."""
+        if self._slots is None:
+            async for content in self._stream(messages):
+                yield content
+            return
+        async with self._slots:
+            async for content in self._stream(messages):
+                yield content
+
+    async def _stream(self, messages):
+        received = []
+        retries = 0
+        while True:
+            request = list(messages)
+            if received:
+                request.append({"role": "assistant", "content": "".join(received)})
+                request.append({"role": "system", "content": RESUME_PROMPT})
+            try:
+                response = await asyncio.wait_for(
+                    self.create(model=self.model, messages=request, stream=True, **self.params),
+                    self.connect_timeout,
+                )
+                chunks = response.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), self.chunk_timeout)
+                    except StopAsyncIteration:
+                        return
+                    content = delta_content(chunk)
+                    if content:
+                        received.append(content)
+                        yield content
+            except Exception as e:
+                if retries >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = backoff_delay(retries, self.backoff, self.max_backoff)
+                else:
+                    delay = min(delay, self.max_backoff)  # A huge Retry-After would hold a concurrency slot for as long
+                retries += 1
+                await asyncio.sleep(delay)
+
+    async def complete(self, messages):
+        """Returns the full content of a streamed response."""
+        parts = []
+        async for content in self.stream(messages):
+            parts.append(content)
+        return "".join(parts)
+
+def percentile(sorted_values, fraction):
+    """Returns the nearest-rank percentile of already sorted values, or None if there are none."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+class StreamMetrics:
+    """Records the timing of one streamed response.
+
+    Create it just before the request, call `record_chunk` for every delta and
+    `finish` once the stream ends to get the turn's record: time to first
+    token, inter-chunk latency percentiles, tokens per second and wall time,
+    all in seconds.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.chunk_times = []
+
+    def record_chunk(self):
+        """Records that a delta arrived now."""
+        self.chunk_times.append(time.perf_counter())
+
+    def finish(self, completion_tokens):
+        """Returns the metrics record for the response."""
+        wall_time = time.perf_counter() - self.start
+        times = self.chunk_times
+        gaps = sorted(later - earlier for earlier, later in zip(times, times[1:]))
+        streaming_time = times[-1] - times[0] if len(times) > 1 else 0
+        return {
+            "time_to_first_token": times[0] - self.start if times else None,
+            "inter_chunk_p50": percentile(gaps, 0.5),
+            "inter_chunk_p90": percentile(gaps, 0.9),
+            "inter_chunk_p99": percentile(gaps, 0.99),
+            "tokens_per_second": completion_tokens / streaming_time if streaming_time else None,
+            "wall_time": wall_time,
+            "completion_tokens": completion_tokens,
+            "chunks": len(times),
+        }
+
+class TerminalRenderer:
+    """Writes streamed deltas to a terminal in coalesced frames.
+
+    Deltas are buffered and written, colored, at most `frame_rate` times a
+    second or whenever `max_chars` characters are pending, instead of one
+    colored write and flush per chunk. Iterating the chunks through `paced`
+    also writes out what is pending once a frame is due while the next chunk
+    is slow to come, so a stalled stream does not leave text unshown. When the
+    output is not a TTY (or `tty` is false) the deltas are written raw and
+    left to the stream's own buffering. The full response is kept as a list of
+    parts and joined once by `close`.
+    """
+
+    def __init__(self, stream=None, color='green', frame_rate=30, max_chars=4096, tty=None):
+        self.stream = stream or sys.stdout
+        self.color = color
+        self.frame_interval = 1 / frame_rate
+        self.max_chars = max_chars
+        self.tty = self.stream.isatty() if tty is None else tty
+        self.parts = []
+        self._pending = []
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, content):
+        """Adds a delta to the response, writing out a frame if one is due."""
+        self.parts.append(content)
+        if not self.tty:
+            self.stream.write(content)
+            return
+        self._pending.append(content)
+        self._pending_chars += len(content)
+        if self._pending_chars >= self.max_chars or time.monotonic() - self._last_flush >= self.frame_interval:
+            self.flush()
+
+    def flush(self):
+        """Writes out any pending deltas as one frame."""
+        with instrumentation.timer("console_output"):
+            if self._pending:
+                instrumentation.count("console_output_chars", self._pending_chars)
+                self.stream.write(colored("".join(self._pending), self.color))
+                self._pending = []
+                self._pending_chars = 0
+            self.stream.flush()
+        self._last_flush = time.monotonic()
+
+    async def paced(self, chunks):
+        """Yields the items of an async iterator, writing out pending deltas whenever the next one takes past a frame."""
+        iterator = chunks.__aiter__()
+        while True:
+            # A task rather than wait_for, so timing out flushes without cancelling the stream.
+            next_chunk = asyncio.ensure_future(iterator.__anext__())
+            while True:
+                timeout = None
+                if self._pending:
+                    timeout = max(0, self._last_flush + self.frame_interval - time.monotonic())
+                done, _ = await asyncio.wait({next_chunk}, timeout=timeout)
+                if done:
+                    break
+                self.flush()
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                return
+            yield chunk
+
+    def close(self):
+        """Writes out what is left and returns the full response."""
+        self.flush()
+        return "".join(self.parts)
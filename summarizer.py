@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import threading
+
+import instrumentation
+from core import LRUCache, evict_files, write_atomic
+
+SUMMARY_PROMPT = "You are responsible for summarizing the previous conversation."
+SUMMARY_PREFIX = "Summary of Removed Messages: "
+
+def summary_request(messages, prompt=SUMMARY_PROMPT):
+    """Returns the messages to send to the API to summarize `messages`."""
+    return list(messages) + [{"role": "system", "content": prompt}]
+
+def summary_message(summary):
+    """Returns the message that stands in for a summarized span of the conversation."""
+    return {"role": "assistant", "content": f'{SUMMARY_PREFIX}{summary}'}
+
+class SummaryCache:
+    """Summarizes message spans, caching each summary by the content it covers.
+
+    Summaries are keyed by a hash of the ordered messages and the summarization
+    prompt, so a span shared across sessions or retried is only summarized once.
+    Entries are kept in an in-memory LRU of `max_entries` and, if `directory` is
+    given, in one file per key there as well, of which the `max_files` most
+    recently used are kept (max_entries by default). Spans longer than
+    `chunk_size`, at least 2, are summarized hierarchically: each chunk is
+    summarized (and cached) on its own, then the chunk summaries are summarized
+    in turn, so a growing history reuses the summaries of the chunks it has
+    already seen. `completion` takes a list of messages and returns the
+    response text, e.g. `openai_chat_completion`.
+    """
+
+    def __init__(self, completion, max_entries=256, directory=None, chunk_size=8, prompt=SUMMARY_PROMPT,
+                 max_files=None):
+        if chunk_size < 2:
+            raise ValueError(f"chunk_size must be at least 2 for spans to shrink, got {chunk_size}")
+        self.completion = completion
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_files = max_entries if max_files is None else max_files
+        self.chunk_size = chunk_size
+        self.prompt = prompt
+        self.hits = 0
+        self.misses = 0
+        self._entries = LRUCache(max_entries)
+        self._written = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, messages):
+        """Returns the cache key for summarizing `messages`."""
+        span = [[message["role"], message.get("name", ""), message["content"]] for message in messages]
+        payload = json.dumps([self.prompt, span], ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.txt")
+
+    def get(self, key):
+        """Returns the cached summary for `key`, or None."""
+        summary = self._entries.get(key)
+        if summary is not None:
+            return summary
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                summary = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # Marks the file as recently used
+        except OSError:
+            pass
+        self._entries.put(key, summary)
+        return summary
+
+    def put(self, key, summary):
+        """Stores a summary under `key`."""
+        self._entries.put(key, summary)
+        if self.directory is not None:
+            write_atomic(self._path(key), summary)
+            self._written += 1
+            if self._written >= max(1, self.max_files // 16):
+                self._written = 0
+                evict_files(self.directory, max_files=self.max_files)
+
+    def summarize(self, messages):
+        """Returns a summary of `messages`, reusing cached summaries of the span and its chunks."""
+        messages = list(messages)
+        if len(messages) <= self.chunk_size:
+            return self._summarize_chunk(messages)
+        children = [
+            summary_message(self._summarize_chunk(messages[i:i + self.chunk_size]))
+            for i in range(0, len(messages), self.chunk_size)
+        ]
+        return self.summarize(children)
+
+    def _summarize_chunk(self, messages):
+        key = self.key(messages)
+        summary = self.get(key)
+        if summary is not None:
+            self.hits += 1
+            instrumentation.count("summary_cache", result="hit")
+            return summary
+        self.misses += 1
+        instrumentation.count("summary_cache", result="miss")
+        summary = self.completion(summary_request(messages, self.prompt))
+        self.put(key, summary)
+        return summary
+
+class BackgroundSummarizer:
+    """Compacts the oldest span of a conversation on a background thread.
+
+    Once the history crosses `soft_limit` (a fraction of `max_tokens`), `start`
+    summarizes the oldest messages that would bring it back down to `target`
+    while the user is still typing. `apply` swaps the finished summary in for
+    that span before the next request, so a long conversation does not wait on
+    a summarization call. `summarize` takes the list of messages to compact and
+    returns the summary text, e.g. `SummaryCache.summarize`. `on_replace`, if
+    given, is called with the messages a summary replaced once it is applied.
+    """
+
+    def __init__(self, summarize, max_tokens, reserve_tokens=0, soft_limit=0.75, target=0.5, on_replace=None):
+        self.summarize = summarize
+        self.on_replace = on_replace
+        self.max_tokens = max_tokens
+        self.reserve_tokens = reserve_tokens
+        self.soft_limit = soft_limit
+        self.target = target
+        self._job = None
+
+    @property
+    def pending(self):
+        """Returns whether a summary has been started and not yet applied."""
+        return self._job is not None
+
+    def start(self, ledger):
+        """Starts summarizing the oldest span if the history is past the soft limit.
+
+        Returns whether a summary was started.
+        """
+        if self._job is not None:
+            return False
+        if ledger.fits(int(self.max_tokens * self.soft_limit), self.reserve_tokens):
+            return False
+        # Always leave the latest message out of the span.
+        count = min(ledger.plan_truncation(int(self.max_tokens * self.target), self.reserve_tokens), len(ledger) - 1)
+        if count < 1:
+            return False
+        span = [ledger[i] for i in range(count)]
+        result = []
+        thread = threading.Thread(target=self._run, args=(span, ledger.count_tokens, result), daemon=True)
+        self._job = (thread, span, result)
+        thread.start()
+        return True
+
+    def _run(self, span, count_tokens, result):
+        try:
+            summary = self.summarize([dict(message) for message in span])  # Plain dicts, whatever the ledger holds
+        except Exception:
+            # Leave the span in place; the caller's synchronous path takes over.
+            return
+        message = summary_message(summary)
+        result.append((summary, message, count_tokens(message)))
+
+    def cancel(self):
+        """Discards a pending summary, e.g. after its span was removed some other way."""
+        self._job = None
+
+    def apply(self, ledger, wait=True):
+        """Swaps a finished summary in for the span it covers and returns the summary text.
+
+        If the summary is still running, waits for it when `wait` is true and
+        otherwise leaves it running. Returns None when there is nothing to apply,
+        the summary failed, or the history no longer starts with the summarized span.
+        """
+        if self._job is None:
+            return None
+        thread, span, result = self._job
+        if thread.is_alive():
+            if not wait:
+                return None
+            thread.join()
+        self._job = None
+        if not result or len(ledger) < len(span):
+            return None
+        if any(ledger[i] is not message for i, message in enumerate(span)):
+            return None
+        summary, message, num_tokens = result[0]
+        removed = ledger.replace_oldest(len(span), message, num_tokens)
+        if self.on_replace is not None:
+            self.on_replace(removed)
+        return summary
@@ -1,70 +1,46 @@
 #!/usr/bin/env python3
-import subprocess
-import sys
+import openai
+from termcolor import colored
 
-def install(package):
-    subprocess.check_call([sys.executable, "-m", "pip", "install", package])
+import instrumentation
+from conversation import ConversationLedger
 
-try:
-    import openai
-except ImportError:
-    print("Installing module: openai")
-    install('openai')
-    import openai
-
-try:
-    import tiktoken
-except ImportError:
-    print("Installing module: tiktoken")
-    install('tiktoken')
-    import tiktoken
-
-try:
-    from termcolor import colored
-except ImportError:
-    print("Installing module: termcolor")
-    install('termcolor')
-    from termcolor import colored
+instrumentation.configure_from_environment()  # LLM_METRICS / LLM_PROFILE, see instrumentation.py
 
 print("")
 openai.api_key = input("Please enter your OpenAI API key: ")
 MAX_TOKENS = 512
+RESPONSE_TOKENS = 128  # Reserved out of MAX_TOKENS for the reply
 
-def num_tokens_from_messages(messages):
-    """Returns the number of tokens used by a list of messages."""
-    model = "gpt-3.5-turbo"
-    encoding = tiktoken.encoding_for_model(model)
-    num_tokens = 0
-    for message in messages:
-        num_tokens += len(encoding.encode(message["content"]))
-    return num_tokens
-
+@instrumentation.timed("completion")
 def openai_chat_completion(messages):
     """Returns the response from the OpenAI API given a list of messages."""
     response = openai.ChatCompletion.create(
         model="gpt-3.5-turbo",
         messages=messages,
+        max_tokens=RESPONSE_TOKENS,
     )
     return response.choices[0].message['content']
 
-conversation_history = []
+conversation_history = ConversationLedger()
 while True:
     user_input = input("\nPlease enter your request (type 'q' or 'quit' to exit): ")
     if user_input.lower() in ['q', 'quit']:
         break
 
     new_message = {"role": "user", "content": user_input}
-    if num_tokens_from_messages(conversation_history + [new_message]) > MAX_TOKENS:
+    new_message_tokens = conversation_history.count_tokens(new_message)
+    if conversation_history.prompt_tokens + new_message_tokens + RESPONSE_TOKENS > MAX_TOKENS:
         print("Conversation history is too long and needs to be truncated.")
         continue
 
-    conversation_history.append(new_message)
-    print(colored("\nFull conversation history:", 'red'))
-    for message in conversation_history:
-        print(message)
-
-    print(colored(f"\n{num_tokens_from_messages(conversation_history)} tokens", 'green'))
+    conversation_history.append(new_message, new_message_tokens)
+    with instrumentation.timer("console_output"):
+        print(colored("\nFull conversation history:", 'red'))
+        for message in conversation_history:
+            print(message)
+        print(colored(f"\n{conversation_history.total_tokens} tokens", 'green'))
 
-    response_content = openai_chat_completion(conversation_history)
+    response_content = openai_chat_completion(conversation_history.messages)
     conversation_history.append({"role": "assistant", "content": response_content})
     print(f"\nResponse: \n{response_content}")
\ No newline at end of file